@@ -1,21 +1,98 @@
-from langchain_openai import ChatOpenAI
-from langchain_community.graphs import Neo4jGraph
-from langchain.chains import GraphCypherQAChain
 from langchain.memory import ConversationBufferWindowMemory
 from langchain.prompts import PromptTemplate
 from dotenv import load_dotenv
+import json
 import os
-from pyvis.network import Network
+from collections import OrderedDict, deque
+import asyncio
+import re
+import threading
+import time
 import uuid
+import weakref
+# Loaded before the local modules below read their settings from the environment
 load_dotenv()
+from cache_for_Design_on_Graph import CypherCache, FlightAbandoned, ResultCache, VisualizationStore, fingerprint_text
+from format_for_Design_on_Graph import serialize_graph_data
+from index_for_Design_on_Graph import GraphIndex
+from knowledge_for_Design_on_Graph import KnowledgeStore, load_knowledge
+from metrics_for_Design_on_Graph import annotate, atraced_stream, llm_config, metrics, span, start_trace, traced_stream
+from neo4j_for_Design_on_Graph import CYPHER_TIMEOUT, NEO4J_POOL_SIZE, executor_for_graph
+from schema_for_Design_on_Graph import SchemaSelector, schema_reduction
+from scheduler_for_Design_on_Graph import PLAN_RULES, format_number, problem_from_knowledge, render_schedule, schedule_assembly
+from validator_for_Design_on_Graph import (GENERIC_CHECKS, ScheduleValidator, describe_operations, failing_segment, parse_schedule,
+                                           render_report, render_rows, render_totals, splice_segment)
 
-llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
-llm_2 = ChatOpenAI(model="gpt-4o", temperature=0)
-llm_3 = ChatOpenAI(model="o1-preview", temperature=0)
+SESSION_MEMORY_WINDOW = 10
+DESIGN_TURNS_IN_PROMPT = int(os.getenv("DESIGN_TURNS_IN_PROMPT", "2"))
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "500"))
+SESSION_IDLE_TIMEOUT = float(os.getenv("SESSION_IDLE_TIMEOUT", "14400"))
 
-graph = Neo4jGraph()
+memory = ConversationBufferWindowMemory(k=SESSION_MEMORY_WINDOW)
 
-memory = ConversationBufferWindowMemory(k=10)
+class Session:
+
+    def __init__(self, memory=None):
+        self.memory = memory or ConversationBufferWindowMemory(k=SESSION_MEMORY_WINDOW)
+        # Facts from every graph answer, kept beyond the memory window
+        self.knowledge = KnowledgeStore()
+        self.design_turns = deque(maxlen=DESIGN_TURNS_IN_PROMPT)
+        self.last_used = time.time()
+
+    def design_context(self):
+        if self.knowledge.is_empty():
+            return self.memory.load_memory_variables({}).get('history', '')
+
+        parts = ["Knowledge retrieved from the knowledge graph so far:", self.knowledge.render()]
+        if self.design_turns:
+            parts.append("Recent design answers:")
+            for question, answer in self.design_turns:
+                parts.append(f"Human: {question}\nAI: {answer}")
+        return "\n\n".join(parts)
+
+    def record(self, question, result, response_type):
+        self.memory.save_context({"input": question}, {"output": result})
+        if response_type == "general" and result != ERROR_ANSWER:
+            self.design_turns.append((question, result))
+
+class SessionStore:
+
+    def __init__(self, max_sessions=MAX_SESSIONS, idle_timeout=SESSION_IDLE_TIMEOUT):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        # Callers without a session id share the module-level memory, as before
+        self.default = Session(memory)
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, session_id=None):
+        if session_id is None:
+            return self.default
+
+        with self.lock:
+            now = time.time()
+            while self.sessions:
+                oldest_id, oldest = next(iter(self.sessions.items()))
+                if now - oldest.last_used <= self.idle_timeout:
+                    break
+                del self.sessions[oldest_id]
+
+            session = self.sessions.get(session_id)
+            if session is None:
+                session = Session()
+                self.sessions[session_id] = session
+            session.last_used = now
+            self.sessions.move_to_end(session_id)
+
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+            return session
+
+    def drop(self, session_id):
+        with self.lock:
+            self.sessions.pop(session_id, None)
+
+sessions = SessionStore()
 
 router_prompt = PromptTemplate(
     input_variables=["question"],
@@ -34,22 +111,443 @@ Only respond with **"graph"** or **"general"**. Do not add any other content.
 """
 )
 
-router_chain = router_prompt | llm
-
-cypher_chain = GraphCypherQAChain.from_llm(
-    llm=llm,
-    graph=graph,
-    allow_dangerous_requests=True,
-    verbose=True,
-    exclude_types=[
-        "Class", "Relationship", "_GraphConfig", "SCO_RESTRICTION",
-        "DOMAIN", "RANGE", "isSubClassOf", "isSubPropertyOf", "hasOptionalAutoOperation",
-        "hasOptionalManualOperation"
-    ],
-    top_k=300,
-    return_direct=True,
-    return_intermediate_steps=True
-)
+CYPHER_EXCLUDE_TYPES = [
+    "Class", "Relationship", "_GraphConfig", "SCO_RESTRICTION",
+    "DOMAIN", "RANGE", "isSubClassOf", "isSubPropertyOf", "hasOptionalAutoOperation",
+    "hasOptionalManualOperation"
+]
+
+GENERAL_QUESTION_MARKER = "this is a general question"
+GRAPH_KEYWORDS = re.compile(r"\b(sub)?(process|operation|resource|predecessor)")
+GENERAL_KEYWORDS = re.compile(r"\b(design|scheme|generat|analy[sz]|check)")
+ROUTE_CACHE_SIZE = 1024
+
+route_cache = OrderedDict()
+route_cache_lock = threading.Lock()
+
+def normalize_question(question):
+    return " ".join(str(question).lower().split())
+
+def classify_question(question):
+    normalized = normalize_question(question)
+    if GENERAL_QUESTION_MARKER in normalized:
+        return "general"
+
+    has_graph_words = bool(GRAPH_KEYWORDS.search(normalized))
+    has_general_words = bool(GENERAL_KEYWORDS.search(normalized))
+    if has_graph_words and not has_general_words:
+        return "graph"
+    if has_general_words and not has_graph_words:
+        return "general"
+    return None
+
+def lookup_route(normalized):
+    with route_cache_lock:
+        route_type = route_cache.get(normalized)
+        if route_type is not None:
+            route_cache.move_to_end(normalized)
+        return route_type
+
+def remember_route(normalized, route_type):
+    with route_cache_lock:
+        route_cache[normalized] = route_type
+        route_cache.move_to_end(normalized)
+        while len(route_cache) > ROUTE_CACHE_SIZE:
+            route_cache.popitem(last=False)
+
+def parse_router_response(response):
+    return "graph" if response.content.strip().lower() == "graph" else "general"
+
+def known_route(question):
+    # The route from the cache or the keyword rules, None when the LLM router has to decide
+    route_type = lookup_route(normalize_question(question))
+    annotate(cache_hit=route_type is not None)
+    if route_type is not None:
+        return route_type
+    route_type = classify_question(question)
+    annotate(route_source="rules" if route_type else "llm")
+    return route_type
+
+def route_question(question):
+    route_type = known_route(question)
+    if route_type is None:
+        # Genuinely ambiguous: fall back to the LLM router
+        route_type = parse_router_response(components.router_chain.invoke({"question": question}, config=llm_config()))
+    remember_route(normalize_question(question), route_type)
+    return route_type
+
+async def aroute_question(question):
+    route_type = known_route(question)
+    if route_type is None:
+        async with concurrency_limits()["llm"]:
+            response = await components.router_chain.ainvoke({"question": question}, config=llm_config())
+        route_type = parse_router_response(response)
+    remember_route(normalize_question(question), route_type)
+    return route_type
+
+CYPHER_CACHE_PATH = os.getenv("CYPHER_CACHE_PATH", os.path.join("cache", "cypher_cache.json"))
+CYPHER_CACHE_SIZE = int(os.getenv("CYPHER_CACHE_SIZE", "512"))
+SCHEMA_REFRESH_INTERVAL = float(os.getenv("SCHEMA_REFRESH_INTERVAL", "600"))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "1800"))
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "256"))
+GRAPH_VERSION_INTERVAL = float(os.getenv("GRAPH_VERSION_INTERVAL", "30"))
+GRAPH_VERSION_QUERY = os.getenv("GRAPH_VERSION_QUERY", """
+CALL { MATCH (n) RETURN count(n) AS nodes }
+CALL { MATCH ()-[r]->() RETURN count(r) AS relationships }
+RETURN nodes, relationships
+""")
+
+GRAPH_ROUTE = "/graph/"
+GRAPH_TTL = float(os.getenv("GRAPH_TTL", "3600"))
+GRAPH_STORE_MAX_BYTES = int(os.getenv("GRAPH_STORE_MAX_BYTES", str(64 * 1024 * 1024)))
+GRAPH_SPILL_DIR = os.getenv("GRAPH_SPILL_DIR")
+
+cypher_cache = CypherCache(CYPHER_CACHE_PATH, max_entries=CYPHER_CACHE_SIZE)
+result_cache = ResultCache(ttl=RESULT_CACHE_TTL, max_entries=RESULT_CACHE_SIZE)
+visualization_store = VisualizationStore(ttl=GRAPH_TTL, max_bytes=GRAPH_STORE_MAX_BYTES, spill_dir=GRAPH_SPILL_DIR)
+schema_state = {"checked_at": 0.0}
+schema_lock = threading.Lock()
+graph_version_state = {"version": None, "checked_at": 0.0}
+graph_version_lock = threading.Lock()
+
+def refresh_graph_schema():
+    from langchain_community.chains.graph_qa.cypher import construct_schema
+    components.graph.refresh_schema()
+    components.cypher_chain.graph_schema = construct_schema(
+        components.graph.get_structured_schema, [], CYPHER_EXCLUDE_TYPES
+    )
+    schema_state["checked_at"] = time.time()
+
+def schema_fingerprint():
+    cypher_chain = components.cypher_chain
+    with schema_lock:
+        if SCHEMA_REFRESH_INTERVAL > 0 and time.time() - schema_state["checked_at"] > SCHEMA_REFRESH_INTERVAL:
+            try:
+                refresh_graph_schema()
+            except Exception as e:
+                print(f"【Error】Failed to refresh the graph schema: {str(e)}")
+                schema_state["checked_at"] = time.time()
+        return fingerprint_text(cypher_chain.graph_schema)
+
+def graph_data_version():
+    with graph_version_lock:
+        if graph_version_state["version"] is None or time.time() - graph_version_state["checked_at"] > GRAPH_VERSION_INTERVAL:
+            try:
+                rows = components.graph.query(GRAPH_VERSION_QUERY)
+                graph_version_state["version"] = fingerprint_text(json.dumps(rows, sort_keys=True, default=str))
+            except Exception as e:
+                # An unknown version never matches a cached entry, so results are recomputed
+                print(f"【Error】Failed to read the graph data version: {str(e)}")
+                graph_version_state["version"] = uuid.uuid4().hex
+            graph_version_state["checked_at"] = time.time()
+        return graph_version_state["version"]
+
+def cached_graph_result(kind, cypher, version, compute, *extra_key):
+    if not cypher:
+        return compute()
+    return result_cache.get_or_compute((kind, cypher, version) + extra_key, compute)
+
+def load_graph_html(graph_ref):
+    if not graph_ref or not graph_ref.startswith(GRAPH_ROUTE):
+        return None
+    return visualization_store.get(graph_ref[len(GRAPH_ROUTE):])
+
+def render_graph(cypher, version, graph_data):
+    with span("visualization", rows=len(graph_data) if isinstance(graph_data, list) else 0) as record:
+        rendered = []
+
+        def render():
+            rendered.append(True)
+            return generate_graph_html(graph_data)
+
+        graph_html = cached_graph_result("graph", cypher, version, render)
+        if not visualization_store.contains(graph_html[len(GRAPH_ROUTE):]):
+            # The cached reference outlived its rendering in the visualization store
+            graph_html = render()
+            if cypher:
+                result_cache.put(("graph", cypher, version), graph_html)
+        record["cache_hit"] = not rendered
+        record["graph"] = graph_html
+    return graph_html
+
+def execute_cypher(cypher):
+    # Generated Cypher runs read-only, under a timeout and a plan check, and stops reading at top_k rows
+    return components.cypher_executor.query(cypher, limit=components.cypher_chain.top_k)
+
+def fetch_graph_data(cypher, version):
+    if not cypher:
+        # The query corrector may reject a statement, which yields no rows, as in GraphCypherQAChain
+        return []
+    with span("neo4j", cypher=cypher) as record:
+        executed = []
+
+        def execute():
+            executed.append(True)
+            return execute_cypher(cypher)
+
+        graph_data = cached_graph_result("data", cypher, version, execute)
+        record["cache_hit"] = not executed
+        record["rows"] = len(graph_data) if isinstance(graph_data, list) else 0
+    return graph_data
+
+CYPHER_FENCE = re.compile(r"```(.*?)```", re.DOTALL)
+
+USE_SCHEMA_SELECTION = os.getenv("USE_SCHEMA_SELECTION", "1") == "1"
+schema_selector_state = {"schema": None, "selector": None}
+schema_selector_lock = threading.Lock()
+
+def schema_selector():
+    # Rebuilt whenever the schema refresh replaces the full schema
+    full_schema = components.cypher_chain.graph_schema
+    with schema_selector_lock:
+        if schema_selector_state["schema"] != full_schema:
+            schema_selector_state["selector"] = SchemaSelector(components.graph.get_structured_schema, CYPHER_EXCLUDE_TYPES)
+            schema_selector_state["schema"] = full_schema
+        return schema_selector_state["selector"]
+
+def question_schema(question):
+    # The part of the schema relevant to the question, and whether anything was left out
+    from langchain_community.chains.graph_qa.cypher import construct_schema
+    full_schema = components.cypher_chain.graph_schema
+    if not USE_SCHEMA_SELECTION:
+        return full_schema, False
+    try:
+        include_types = schema_selector().select(question)
+    except Exception as e:
+        print(f"【Warning】Schema selection failed, using the full schema: {str(e)}")
+        include_types = None
+    if not include_types:
+        return full_schema, False
+
+    schema = construct_schema(components.graph.get_structured_schema, include_types, [])
+    reduction = schema_reduction(full_schema, schema)
+    annotate(schema_types=include_types, schema_tokens=reduction["tokens"], full_schema_tokens=reduction["full_tokens"])
+    metrics.increment("schema_prompt_tokens_total", "Schema tokens in Cypher prompts, selected versus full",
+                      reduction["tokens"], schema="selected")
+    metrics.increment("schema_prompt_tokens_total", "Schema tokens in Cypher prompts, selected versus full",
+                      reduction["full_tokens"], schema="full")
+    return schema, True
+
+def cypher_generation_inputs(question, schema=None):
+    if schema is None:
+        schema, _ = question_schema(question)
+    return {"question": question, "schema": schema}
+
+def finish_generated_cypher(generated_cypher):
+    # Unwrap a fenced statement, as GraphCypherQAChain does
+    fenced = CYPHER_FENCE.search(generated_cypher)
+    if fenced:
+        generated_cypher = fenced.group(1)
+    if components.cypher_chain.cypher_query_corrector:
+        generated_cypher = components.cypher_chain.cypher_query_corrector(generated_cypher)
+    annotate(cypher=generated_cypher)
+    return generated_cypher
+
+# Generation and execution of GraphCypherQAChain run separately so each is timed and cached on its own
+def generate_cypher(question, schema=None):
+    with span("cypher_generation", cache_hit=False):
+        generation_chain = components.cypher_chain.cypher_generation_chain
+        output = generation_chain.invoke(cypher_generation_inputs(question, schema), config=llm_config())
+        return finish_generated_cypher(output[generation_chain.output_key])
+
+async def agenerate_cypher(question, schema=None):
+    if schema is None:
+        # Building the selector can load an embedding model and counting tokens is CPU work, keep both off the loop
+        schema, _ = await asyncio.to_thread(question_schema, question)
+    with span("cypher_generation", cache_hit=False):
+        async with concurrency_limits()["llm"]:
+            generation_chain = components.cypher_chain.cypher_generation_chain
+            output = await generation_chain.ainvoke(cypher_generation_inputs(question, schema), config=llm_config())
+        return finish_generated_cypher(output[generation_chain.output_key])
+
+def run_cached_cypher(question_key, fingerprint, version):
+    generated_cypher = cypher_cache.get(question_key, fingerprint)
+    if not generated_cypher:
+        return None, None
+
+    print("【Cache】Reusing cached Cypher for this question")
+    with span("cypher_generation", cache_hit=True, cypher=generated_cypher):
+        pass
+    try:
+        graph_data = fetch_graph_data(generated_cypher, version)
+    except Exception as e:
+        print(f"【Cache】Cached Cypher failed, regenerating: {str(e)}")
+        cypher_cache.discard(question_key)
+        return None, None
+    return generated_cypher, graph_data
+
+USE_GRAPH_INDEX = os.getenv("USE_GRAPH_INDEX", "1") == "1"
+GRAPH_INDEX_MAX_AGE = float(os.getenv("GRAPH_INDEX_MAX_AGE", "600"))
+graph_index = GraphIndex(max_age=GRAPH_INDEX_MAX_AGE)
+
+def refresh_graph_index(version):
+    if graph_index.refresh(version, components.graph.query):
+        print(f"【System】Graph index loaded: {len(graph_index.closures)} operations, "
+              f"{len(graph_index.knowledge.resources)} resources, {len(graph_index.knowledge.processes)} processes")
+
+def warm_graph_index():
+    if not USE_GRAPH_INDEX:
+        return
+    try:
+        refresh_graph_index(graph_data_version())
+    except Exception as e:
+        print(f"【Error】Failed to load the graph index: {str(e)}")
+
+def lookup_graph_index(question, version, refresh=True):
+    # Recognized question shapes are answered in process, without the LLM and the Neo4j round trip
+    with span("graph_index") as record:
+        if refresh:
+            refresh_graph_index(version)
+        indexed = graph_index.answer(normalize_question(question))
+        record["cache_hit"] = indexed is not None
+        if indexed is None:
+            return None
+        intent, cypher, rows = indexed
+        record.update(intent=intent, rows=len(rows))
+    print(f"【System】Answered from the graph index ({intent})")
+    return cypher, rows[:components.cypher_chain.top_k]
+
+def fetch_selected_schema_data(generated_cypher, version):
+    # Cypher written against a pruned schema gets one retry with the full schema when it fails or finds nothing
+    try:
+        graph_data = fetch_graph_data(generated_cypher, version)
+        if graph_data:
+            return graph_data
+        reason = "no rows"
+    except Exception as e:
+        reason = str(e)
+    print(f"【Warning】Cypher from the selected schema failed ({reason}), regenerating with the full schema")
+    metrics.increment("schema_fallbacks_total", "Cypher regenerated with the full schema")
+    return None
+
+def run_generated_cypher(question, version):
+    schema, pruned = question_schema(question)
+    generated_cypher = generate_cypher(question, schema)
+    graph_data = fetch_selected_schema_data(generated_cypher, version) if pruned else None
+    if graph_data is None:
+        if pruned:
+            generated_cypher = generate_cypher(question, components.cypher_chain.graph_schema)
+        graph_data = fetch_graph_data(generated_cypher, version)
+    return generated_cypher, graph_data
+
+async def agenerate_speculative_cypher(question):
+    # The schema is selected once and handed on with the Cypher, so its tokens are counted once per question
+    schema, pruned = await asyncio.to_thread(question_schema, question)
+    return schema, pruned, await agenerate_cypher(question, schema)
+
+async def arun_generated_cypher(question, version, speculation=None):
+    if speculation is not None:
+        schema, pruned, generated_cypher = await speculation
+    else:
+        schema, pruned = await asyncio.to_thread(question_schema, question)
+        generated_cypher = await agenerate_cypher(question, schema)
+    graph_data = await run_neo4j_call(fetch_selected_schema_data, generated_cypher, version) if pruned else None
+    if graph_data is None:
+        if pruned:
+            generated_cypher = await agenerate_cypher(question, components.cypher_chain.graph_schema)
+        graph_data = await run_neo4j_call(fetch_graph_data, generated_cypher, version)
+    return generated_cypher, graph_data
+
+def run_cypher_query(question):
+    question_key = normalize_question(question)
+    fingerprint = schema_fingerprint()
+    version = graph_data_version()
+
+    indexed = lookup_graph_index(question, version) if USE_GRAPH_INDEX else None
+    if indexed is not None:
+        return indexed + (version,)
+
+    generated_cypher, graph_data = run_cached_cypher(question_key, fingerprint, version)
+    if graph_data is None:
+        generated_cypher, graph_data = run_generated_cypher(question, version)
+        if generated_cypher:
+            cypher_cache.put(question_key, fingerprint, generated_cypher)
+
+    cypher = generated_cypher.replace("cypher", "").strip()
+    return cypher, graph_data, version
+
+async def arun_cypher_query(question, speculation=None):
+    question_key = normalize_question(question)
+    fingerprint, version = await run_neo4j_call(lambda: (schema_fingerprint(), graph_data_version()))
+
+    if USE_GRAPH_INDEX:
+        # The reload runs the canonical queries, so it happens in a worker thread and never on the loop
+        if not graph_index.is_current(version):
+            await run_neo4j_call(refresh_graph_index, version)
+        indexed = lookup_graph_index(question, version, refresh=False)
+        if indexed is not None:
+            if speculation is not None:
+                speculation.cancel()
+            return indexed + (version,)
+
+    generated_cypher, graph_data = await run_neo4j_call(run_cached_cypher, question_key, fingerprint, version)
+    if graph_data is not None and speculation is not None:
+        speculation.cancel()
+    if graph_data is None:
+        generated_cypher, graph_data = await arun_generated_cypher(question, version, speculation)
+        if generated_cypher:
+            # Saving the cache writes JSON to disk
+            await asyncio.to_thread(cypher_cache.put, question_key, fingerprint, generated_cypher)
+
+    cypher = generated_cypher.replace("cypher", "").strip()
+    return cypher, graph_data, version
+
+# off, generate (Cypher generation overlaps the LLM router) or execute (the Neo4j query overlaps it too)
+SPECULATIVE_ROUTING = os.getenv("SPECULATIVE_ROUTING", "off")
+
+def start_speculation(question):
+    # Only questions left to the LLM router are worth it, the others are routed without any latency
+    normalized = normalize_question(question)
+    if SPECULATIVE_ROUTING not in ("generate", "execute"):
+        return None
+    if lookup_route(normalized) is not None or classify_question(question) is not None:
+        return None
+    if USE_GRAPH_INDEX and graph_index.answer(normalized) is not None:
+        return None
+
+    work = arun_cypher_query(question) if SPECULATIVE_ROUTING == "execute" else agenerate_speculative_cypher(question)
+    speculation = asyncio.create_task(work)
+    # A discarded speculation may still fail, its exception is not worth a warning
+    speculation.add_done_callback(lambda task: task.cancelled() or task.exception())
+    return speculation
+
+def settle_speculation(speculation, route_type):
+    hit = route_type == "graph"
+    metrics.increment("speculations_total", "Speculative Cypher runs by router outcome",
+                      mode=SPECULATIVE_ROUTING, result="hit" if hit else "miss")
+    annotate(speculation="hit" if hit else "miss")
+    if not hit:
+        speculation.cancel()
+        return None
+    return speculation
+
+async def aspeculative_cypher_query(question, speculation):
+    if speculation is not None and SPECULATIVE_ROUTING == "execute":
+        return await speculation
+    return await arun_cypher_query(question, speculation)
+
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))
+NEO4J_CONCURRENCY = int(os.getenv("NEO4J_CONCURRENCY", "4"))
+
+concurrency_limits_by_loop = weakref.WeakKeyDictionary()
+
+def concurrency_limits():
+    # asyncio semaphores belong to one event loop, so keep a pair per loop
+    loop = asyncio.get_running_loop()
+    limits = concurrency_limits_by_loop.get(loop)
+    if limits is None:
+        limits = {
+            "llm": asyncio.Semaphore(LLM_CONCURRENCY),
+            "neo4j": asyncio.Semaphore(NEO4J_CONCURRENCY)
+        }
+        concurrency_limits_by_loop[loop] = limits
+    return limits
+
+async def run_neo4j_call(func, *args):
+    async with concurrency_limits()["neo4j"]:
+        return await asyncio.to_thread(func, *args)
+
+GRAPH_DATA_TOKEN_BUDGET = int(os.getenv("GRAPH_DATA_TOKEN_BUDGET", "6000"))
 
 graph_response_prompt = PromptTemplate(
     input_variables=["question", "graph_data", "cypher"],
@@ -62,7 +560,10 @@ Current question: {question}
 
 Cypher query executed: {cypher}
 
-Query results from the knowledge graph: {graph_data}
+Query results from the knowledge graph: 
+{graph_data}
+
+Result format: "Columns" names the fields of each row, rows list their values in that order separated by " | ", each "Constant" line gives a field that has the same value in every row, "count" is how often an identical row occurred, and a marker such as ~A stands for the text defined for it under "Prefixes". Always write values out in full, with prefixes expanded.
 
 Instructions:
 1. Carefully analyze the query result and extract only the relevant information needed to answer the current question.
@@ -73,7 +574,6 @@ Instructions:
 """
 )
 
-graph_response_chain = graph_response_prompt | llm_2
 
 general_qa_prompt = PromptTemplate(
     input_variables=["question", "history"],
@@ -118,69 +618,675 @@ Note:
 ▪ Parallel Group: Use letter suffix (a, b)
 ▪ This plan must include the assembly of four quarter-fuselages.
 ▪ You must generate a complete list of scheme without any form of omission
+"""
+)
+
+USE_SCHEDULER = os.getenv("USE_SCHEDULER", "1") == "1"
+PLAN_KEYWORDS = re.compile(r"\bdesign\b.*\b(scheme|plan)\b")
+NUMBER_WORDS = {"one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8}
+NUMBER = r"(\d+|" + "|".join(NUMBER_WORDS) + r")"
+BODY_COUNT = re.compile(r"\b" + NUMBER + r"\s+(?:(?:automatic|automated|manual)\s+)?(?:1/4\s+|quarter\s+)?bodies\b")
+MANUAL_PARALLEL_LIMIT = re.compile(r"\bat most\s+" + NUMBER + r"\s+(?:sets? of\s+)?manual\b")
+SINGLE_METHOD = re.compile(r"\bonly\s+(automatic|automated|manual)\b|\b(automatic|automated|manual)\s+(methods?|assembly|operations)\s+only\b|"
+                           r"\b(no|without)\s+(automatic|automated|manual)\b")
+
+plan_explanation_prompt = PromptTemplate(
+    input_variables=["question", "schedule"],
+    template=""" 
+You are an expert in aircraft fuselage assembly planning. The assembly scheme below was computed by a scheduling engine from the operations, durations, resources and predecessors stored in the knowledge graph. It already satisfies the constraints of the question.
+
+Current question: {question}
+
+Computed scheme:
+{schedule}
+
+Instructions:
+1. Do not repeat, change or regenerate the table; it is shown to the user above your answer.
+2. Explain briefly why this mix of automatic and manual 1/4 body assemblies was chosen and how it reaches the total time and cost.
+3. For each constraint in the question, state in one line how the scheme satisfies it, marked with ✓.
+"""
+)
+
+VALIDATION_REPAIR_ATTEMPTS = int(os.getenv("VALIDATION_REPAIR_ATTEMPTS", "2"))
+CHECK_KEYWORDS = re.compile(r"\bcheck\b.*\b(scheme|plan)")
+
+repair_prompt = PromptTemplate(
+    input_variables=["question", "operations", "before", "rows", "violations", "start_time", "constraints"],
+    template=""" 
+You are an expert in aircraft fuselage assembly planning. Part of an assembly scheme violates its constraints. Regenerate only that part.
+
+Original question: {question}
+
+Operations involved, from the knowledge graph:
+{operations}
+
+Rows directly before the failing part (keep them unchanged):
+{before}
+
+Failing rows:
+{rows}
+
+Violations found by the validator:
+{violations}
 
-Phase 4. **Validation Report**:
-- Check if the following conditions are met. Mark ✓ if met, and ✗ if not met.
-▪ [✓/✗] Completed 4 assemblies of 1/4 body
-▪ [✓/✗] Automatic operations are executed sequentially
-▪ [✓/✗] No manual/auto overlap
-▪ [✓/✗] Shared steps correctly positioned 
-▪ [✓/✗] Resource limits maintained
-- If any of the conditions is not met, re-execute phase 3.
+Instructions:
+1. Output only the regenerated rows as a markdown table with the columns | Order | Operation | Type | Required Resources | Duration | Start Time | End Time | Parallel Group |.
+2. Keep the same operations and the same number of executions, change only their order, timing and parallel groups.
+3. The first regenerated row starts at {start_time}.
+4. Every operation starts only after all its immediate predecessors have finished, durations match the knowledge graph, {constraints}.
 """
 )
+PLAN_REPAIR_CONSTRAINTS = "automatic operations run alone, and only identical manual operations run in parallel"
+GENERIC_REPAIR_CONSTRAINTS = "automatic and manual operations do not overlap, and resource quantities are respected"
+
+GRAPH_SCHEMA_SNAPSHOT = os.getenv("GRAPH_SCHEMA_SNAPSHOT")
+
+def save_schema_snapshot(path, graph=None):
+    graph = graph or components.graph
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({
+            "schema": graph.get_schema,
+            "structured_schema": graph.get_structured_schema
+        }, f, ensure_ascii=False, indent=2, default=str)
+
+def load_schema_snapshot(graph, path):
+    with open(path, "r", encoding="utf-8") as f:
+        snapshot = json.load(f)
+    graph.schema = snapshot.get("schema", "")
+    graph.structured_schema = snapshot.get("structured_schema", {})
+
+def parse_rate_limits(text):
+    # "gpt-4o-mini=5,gpt-4o=2" -> requests per second for each model
+    limits = {}
+    for item in (text or "").split(","):
+        if "=" in item:
+            model, rate = item.split("=", 1)
+            limits[model.strip()] = float(rate)
+    return limits
+
+MODEL_RATE_LIMITS = parse_rate_limits(os.getenv("MODEL_RATE_LIMITS"))
+
+class Components:
+
+    def __init__(self, schema_snapshot=GRAPH_SCHEMA_SNAPSHOT, rate_limits=None, **overrides):
+        self.schema_snapshot = schema_snapshot
+        self.rate_limits = MODEL_RATE_LIMITS if rate_limits is None else rate_limits
+        self.rate_limiters = {}
+        self.instances = dict(overrides)
+        self.lock = threading.RLock()
+
+    def get(self, name):
+        instance = self.instances.get(name)
+        if instance is None:
+            with self.lock:
+                instance = self.instances.get(name)
+                if instance is None:
+                    instance = getattr(self, f"build_{name}")()
+                    self.instances[name] = instance
+        return instance
+
+    def reset(self):
+        with self.lock:
+            self.instances.clear()
+
+    def rate_limiter(self, model):
+        # One token bucket per model, shared by every chain calling it
+        rate = self.rate_limits.get(model)
+        if not rate:
+            return None
+        from langchain_core.rate_limiters import InMemoryRateLimiter
+        with self.lock:
+            if model not in self.rate_limiters:
+                self.rate_limiters[model] = InMemoryRateLimiter(requests_per_second=rate, check_every_n_seconds=0.05)
+            return self.rate_limiters[model]
+
+    # Heavy client libraries are imported on first use to keep module import cheap
+    def build_llm(self):
+        from langchain_openai import ChatOpenAI
+        return ChatOpenAI(model="gpt-4o-mini", temperature=0, stream_usage=True, rate_limiter=self.rate_limiter("gpt-4o-mini"))
+
+    def build_llm_2(self):
+        from langchain_openai import ChatOpenAI
+        return ChatOpenAI(model="gpt-4o", temperature=0, stream_usage=True, rate_limiter=self.rate_limiter("gpt-4o"))
+
+    def build_llm_3(self):
+        from langchain_openai import ChatOpenAI
+        return ChatOpenAI(model="o1-preview", temperature=0, stream_usage=True, rate_limiter=self.rate_limiter("o1-preview"))
+
+    def build_graph(self):
+        from langchain_community.graphs import Neo4jGraph
+        options = {"timeout": CYPHER_TIMEOUT, "driver_config": {"max_connection_pool_size": NEO4J_POOL_SIZE}}
+        if self.schema_snapshot and os.path.exists(self.schema_snapshot):
+            # Skip live introspection, the periodic schema refresh still catches drift later
+            graph = Neo4jGraph(refresh_schema=False, **options)
+            load_schema_snapshot(graph, self.schema_snapshot)
+        else:
+            graph = Neo4jGraph(**options)
+        schema_state["checked_at"] = time.time()
+        return graph
+
+    def build_cypher_executor(self):
+        return executor_for_graph(self.graph)
+
+    def build_router_chain(self):
+        return router_prompt | self.llm
+
+    def build_cypher_chain(self):
+        from langchain.chains import GraphCypherQAChain
+        return GraphCypherQAChain.from_llm(
+            llm=self.llm,
+            graph=self.graph,
+            allow_dangerous_requests=True,
+            verbose=True,
+            exclude_types=CYPHER_EXCLUDE_TYPES,
+            top_k=300,
+            return_direct=True,
+            return_intermediate_steps=True
+        )
+
+    def build_graph_response_chain(self):
+        return graph_response_prompt | self.llm_2
+
+    def build_general_qa_chain(self):
+        return general_qa_prompt | self.llm_3
+
+    def build_plan_explanation_chain(self):
+        return plan_explanation_prompt | self.llm_2
+
+    def build_repair_chain(self):
+        return repair_prompt | self.llm_2
+
+    llm = property(lambda self: self.get("llm"))
+    llm_2 = property(lambda self: self.get("llm_2"))
+    llm_3 = property(lambda self: self.get("llm_3"))
+    graph = property(lambda self: self.get("graph"))
+    cypher_executor = property(lambda self: self.get("cypher_executor"))
+    router_chain = property(lambda self: self.get("router_chain"))
+    cypher_chain = property(lambda self: self.get("cypher_chain"))
+    graph_response_chain = property(lambda self: self.get("graph_response_chain"))
+    general_qa_chain = property(lambda self: self.get("general_qa_chain"))
+    plan_explanation_chain = property(lambda self: self.get("plan_explanation_chain"))
+    repair_chain = property(lambda self: self.get("repair_chain"))
+
+components = Components()
+
+def configure_components(schema_snapshot=GRAPH_SCHEMA_SNAPSHOT, rate_limits=None, **overrides):
+    global components
+    components = Components(schema_snapshot=schema_snapshot, rate_limits=rate_limits, **overrides)
+    schema_state["checked_at"] = time.time()
+    return components
+
+def __getattr__(name):
+    # Keep `from Design_on_Graph import llm, graph, cypher_chain, ...` working without eager construction
+    if hasattr(Components, f"build_{name}"):
+        return components.get(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def stream_answer(chain, inputs, answer_key=None):
+    with span("answer") as record:
+        state, value = result_cache.begin(answer_key) if answer_key else ("lead", None)
+        while state == "wait":
+            # An identical request is already streaming this answer, share its result
+            try:
+                value = value.result()
+                state = "hit"
+            except FlightAbandoned:
+                # That request stopped early, one of the waiters streams the answer instead
+                state, value = result_cache.begin(answer_key)
+        record["cache_hit"] = state != "lead"
+        if state == "hit":
+            yield value
+            return
+
+        result = ""
+        try:
+            for chunk in chain.stream(inputs, config=llm_config()):
+                result += chunk.content
+                yield result
+        except BaseException as e:
+            if answer_key:
+                result_cache.abandon(answer_key, e)
+            raise
+        if answer_key:
+            result_cache.finish(answer_key, result)
+
+async def astream_answer(chain, inputs, answer_key=None):
+    with span("answer") as record:
+        state, value = result_cache.begin(answer_key) if answer_key else ("lead", None)
+        while state == "wait":
+            flight = asyncio.wrap_future(value)
+            # Shielded so a cancelled waiter does not cancel the shared future of the others
+            flight.add_done_callback(lambda f: f.cancelled() or f.exception())
+            try:
+                value = await asyncio.shield(flight)
+                state = "hit"
+            except FlightAbandoned:
+                state, value = result_cache.begin(answer_key)
+        record["cache_hit"] = state != "lead"
+        if state == "hit":
+            yield value
+            return
+
+        result = ""
+        try:
+            async with concurrency_limits()["llm"]:
+                async for chunk in chain.astream(inputs, config=llm_config()):
+                    result += chunk.content
+                    yield result
+        except BaseException as e:
+            if answer_key:
+                result_cache.abandon(answer_key, e)
+            raise
+        if answer_key:
+            result_cache.finish(answer_key, result)
+
+def graph_answer_request(question, cypher, graph_data, version):
+    compact_graph_data, stats = serialize_graph_data(graph_data, GRAPH_DATA_TOKEN_BUDGET)
+    annotate(graph_data_raw_tokens=stats["raw_tokens"], graph_data_tokens=stats["compact_tokens"])
+    if stats["over_budget"]:
+        # Values are never dropped to fit: the prompt promises the model the complete data
+        print(f"【Warning】Graph data needs {stats['compact_tokens']} tokens, "
+              f"over the budget of {GRAPH_DATA_TOKEN_BUDGET}; sending it complete")
+
+    inputs = {
+        "question": question,
+        "graph_data": compact_graph_data,
+        "cypher": cypher
+    }
+    answer_key = ("answer", cypher, version, normalize_question(question)) if cypher else None
+    return components.graph_response_chain, inputs, answer_key
+
+def general_answer_request(question, session):
+    inputs = {
+        "question": question,
+        "history": session.design_context()
+    }
+    return components.general_qa_chain, inputs, None
+
+def load_graph_knowledge(version):
+    if USE_GRAPH_INDEX:
+        # The index already holds the canonical query results
+        refresh_graph_index(version)
+        return graph_index.knowledge
+    return cached_graph_result("knowledge", "canonical", version, lambda: load_knowledge(components.graph.query))
+
+def planning_problems(session):
+    sources = [("knowledge graph", lambda: load_graph_knowledge(graph_data_version())),
+               ("conversation", lambda: session.knowledge)]
+    for source, load in sources:
+        try:
+            problem = problem_from_knowledge(load())
+        except Exception as e:
+            print(f"【Warning】Cannot load the planning data from the {source}: {str(e)}")
+            continue
+        if problem["operations"]:
+            yield source, problem
+
+def number_value(text):
+    return int(text) if text.isdigit() else NUMBER_WORDS[text]
+
+def plan_rules_question(question, rules=PLAN_RULES):
+    # The scheduler encodes one set of constraints; schemes asking for anything else are designed by the LLM
+    text = normalize_question(question)
+    if not PLAN_KEYWORDS.search(text) or SINGLE_METHOD.search(text):
+        return False
+    if "automatic" not in text or "manual" not in text:
+        return False
+    codes = rules["start_operations"] + rules["end_operations"] + [rules["auto_completion"], rules["manual_completion"]]
+    if not all(code.lower() in text for code in codes):
+        return False
+    bodies = [number_value(n) for n in BODY_COUNT.findall(text)]
+    limits = [number_value(n) for n in MANUAL_PARALLEL_LIMIT.findall(text)]
+    return (bool(bodies) and all(n == int(rules["bodies"]) for n in bodies)
+            and all(n == int(rules["max_parallel_manual"]) for n in limits))
+
+def plan_schedule(question, session):
+    if not USE_SCHEDULER or not plan_rules_question(question):
+        return None
+
+    for source, problem in planning_problems(session):
+        try:
+            with span("scheduler", source=source) as record:
+                schedule = schedule_assembly(problem)
+                record["rows"] = len(schedule["rows"])
+            print(f"【System】Scheduled the assembly from the {source} in {record['duration']:.3f}s")
+            return render_schedule(schedule)
+        except Exception as e:
+            print(f"【Warning】Cannot schedule from the {source}: {str(e)}")
+    return None
+
+def previous_scheme(question, session):
+    # The last design answer with a scheme table, with the question it answered
+    if not CHECK_KEYWORDS.search(normalize_question(question)):
+        return None, None
+    for scheme_question, answer in reversed(session.design_turns):
+        if parse_schedule(answer):
+            return scheme_question, answer
+    return None, None
+
+def regenerate_segment(question, rows, segment, violations, problem, plan_rules=True):
+    first, last = segment
+    failing = rows[first:last + 1]
+    inputs = {
+        "question": question,
+        "operations": describe_operations(problem, [row["operation"] for row in failing]),
+        "before": render_rows(rows[max(0, first - 2):first], header=False) or "(start of the scheme)",
+        "rows": render_rows(failing),
+        "violations": "\n".join(f"- {violation['message']}" for violation in violations),
+        "start_time": format_number(min(row["start"] for row in failing)),
+        "constraints": PLAN_REPAIR_CONSTRAINTS if plan_rules else GENERIC_REPAIR_CONSTRAINTS
+    }
+    print(f"【System】Regenerating rows {first + 1}-{last + 1} of {len(rows)} of the scheme")
+    with span("repair", rows=last - first + 1):
+        response = components.repair_chain.invoke(inputs, config=llm_config())
+    return parse_schedule(response.content, headerless=True)
+
+def validate_design(question, answer, session, scheme_question=None):
+    rows = parse_schedule(answer)
+    if not rows:
+        return None
+    source, problem = next(planning_problems(session), (None, None))
+    if problem is None:
+        return None
+
+    # Schemes for other constraints are only checked against the graph, not against the Plan rules
+    checks = None if plan_rules_question(scheme_question or question) else GENERIC_CHECKS
+    validator = ScheduleValidator(problem, checks=checks)
+    with span("validation", source=source, rows=len(rows)) as record:
+        violations = validator.validate(rows)
+        record["violations"] = len(violations)
+    print(f"【System】Validated {len(rows)} scheme rows against the {source}: {len(violations)} violations")
+    parts = [render_report(violations, source=source, checks=checks)]
+
+    # Only the rows around the violations go back to the model, the rest of the scheme is kept
+    repaired = False
+    for _ in range(VALIDATION_REPAIR_ATTEMPTS):
+        segment = failing_segment(rows, violations)
+        if segment is None:
+            break
+        new_rows = regenerate_segment(question, rows, segment, violations, problem, checks is None)
+        if not new_rows:
+            break
+        rows = splice_segment(rows, segment[0], segment[1], new_rows)
+        with span("validation", source=source, rows=len(rows)) as record:
+            violations = validator.validate(rows)
+            record["violations"] = len(violations)
+        repaired = True
+        if not violations:
+            break
+
+    if repaired:
+        parts.append("**Regenerated scheme** (only the failing rows were regenerated):")
+        parts.append(render_rows(rows) + "\n\n" + render_totals(rows, problem))
+        parts.append(render_report(violations, source=source, checks=checks))
+    return "\n\n".join(parts)
+
+def plan_answer_request(question, schedule):
+    inputs = {
+        "question": question,
+        "schedule": schedule
+    }
+    return components.plan_explanation_chain, inputs, ("plan", fingerprint_text(question + schedule))
+
+DEBUG_RAW_DATA = os.getenv("DEBUG_RAW_DATA", "0") == "1"
+ERROR_ANSWER = "Sorry, there was an error processing your question. Please try asking the question again or ask a different question."
+
+class Turn:
+    # One question through the pipeline; the sync and async paths only differ in how they wait for each step
 
-general_qa_chain = general_qa_prompt | llm_3
+    def __init__(self, question, session_id=None, details=None):
+        self.question = question
+        self.session = sessions.get(session_id)
+        self.trace = start_trace(question, session_id)
+        self.details = details
+        self.status = "ok"
+        self.route = None
+        self.cypher = self.graph_data = self.version = None
+        self.graph_html = None
+        self.result = ""
+        self.answer_prefix = ""
+        self.answer_request = None
+        self.validate_answer = False
 
-def smart_qa_system(question):
-    history = memory.load_memory_variables({}).get('history', '')
-    graph_html = None
+    def step(self):
+        return self.result, self.graph_html
+
+    def use_graph_data(self, cypher, graph_data, version):
+        self.cypher, self.graph_data, self.version = cypher, graph_data, version
+        self.session.knowledge.ingest(graph_data)
+        if DEBUG_RAW_DATA:
+            print(f"【Debug】Raw data for knowledge graphs: {graph_data}")
+        self.answer_request = graph_answer_request(self.question, cypher, graph_data, version)
+
+    def prepare_general(self):
+        # Blocking: the scheduler and the validator read the planning data from the graph
+        schedule = plan_schedule(self.question, self.session)
+        if schedule:
+            print("【System】Judged as a Plan question, scheduled natively and explained by the answer assistant.")
+            self.answer_request = plan_answer_request(self.question, schedule)
+            self.answer_prefix = schedule + "\n\n"
+            return
+
+        scheme_question, scheme = previous_scheme(self.question, self.session)
+        report = validate_design(self.question, scheme, self.session, scheme_question) if scheme else None
+        if report:
+            print("【System】Judged as a Check question, validated against the planning data.")
+            self.result = report
+            return
+
+        print("【System】Judged as a Design question, answered using the reasoning assistant.")
+        self.answer_request = general_answer_request(self.question, self.session)
+        self.validate_answer = True
+
+    def add_partial(self, partial):
+        self.result = self.answer_prefix + partial
+        return self.step()
+
+    def validate(self):
+        # Blocking, returns whether the answer changed
+        report = validate_design(self.question, self.result, self.session) if self.validate_answer else None
+        if report:
+            self.result += "\n\n" + report
+        return bool(report)
+
+    def fail(self, e):
+        print(f"【Error】Errors in dealing with problems: {str(e)}")
+        self.status = "error"
+        self.result = ERROR_ANSWER
+
+    def finish(self):
+        with span("memory"):
+            self.session.record(self.question, self.result, self.route)
+        self.trace.finish(self.route, self.status)
+        if self.details is not None:
+            # Callers such as the batch runner also want the intermediate results
+            self.details.update(route=self.route, status=self.status, cypher=self.cypher, graph_data=self.graph_data)
+
+def stream_smart_qa_system(question, session_id=None, details=None):
+    for step in traced_stream(stream_question(question, session_id, details)):
+        yield step
+
+def stream_question(question, session_id=None, details=None):
+    turn = Turn(question, session_id, details)
     try:
-        response = router_chain.invoke({"question": question})
-        response_type = response.content.strip().lower()
+        with span("router"):
+            turn.route = route_question(question)
 
-        if response_type == "graph":
+        if turn.route == "graph":
             print("【System】Judged as a Graph problem, queried using the query assistant")
+            turn.use_graph_data(*run_cypher_query(question))
+            turn.graph_html = render_graph(turn.cypher, turn.version, turn.graph_data)
+            yield turn.step()
+        else:
+            turn.prepare_general()
+            if turn.result:
+                yield turn.step()
 
-            cypher_output = cypher_chain.invoke({"query": question})
-            graph_data = cypher_output.get("result", cypher_output)
+        if turn.answer_request is not None:
+            for partial in stream_answer(*turn.answer_request):
+                yield turn.add_partial(partial)
 
-            intermediate_steps = cypher_output.get("intermediate_steps", [])
-            if intermediate_steps and isinstance(intermediate_steps[0], dict):
-                cypher = intermediate_steps[0].get("query", "").replace("cypher", "").strip()
-            else:
-                cypher = ""
+        if turn.validate():
+            yield turn.step()
 
-            print(f"【Debug】Generated Cypher: {cypher}")
-            print(f"【Debug】Raw data for knowledge graphs: {graph_data}")
+    except Exception as e:
+        turn.fail(e)
+        yield turn.step()
+
+    turn.finish()
+
+def smart_qa_system(question, session_id=None, details=None):
+    result, graph_html = "", None
+    for result, graph_html in stream_smart_qa_system(question, session_id, details):
+        pass
+    return result, graph_html
 
-            graph_html = generate_graph_html(graph_data)
-            print(f"【Debug】Path to the HTML file of the generated Knowledge Graph: {graph_html}")
+async def astream_smart_qa_system(question, session_id=None, details=None):
+    async for step in atraced_stream(astream_question(question, session_id, details)):
+        yield step
 
-            answer = graph_response_chain.invoke({
-                "question": question,
-                "graph_data": graph_data,
-                "cypher": cypher
-            })
+async def astream_question(question, session_id=None, details=None):
+    turn = Turn(question, session_id, details)
+    speculation = None
+    try:
+        with span("router"):
+            speculation = start_speculation(question)
+            turn.route = await aroute_question(question)
+            if speculation is not None:
+                speculation = settle_speculation(speculation, turn.route)
+
+        if turn.route == "graph":
+            print("【System】Judged as a Graph problem, queried using the query assistant")
+            turn.use_graph_data(*await aspeculative_cypher_query(question, speculation))
+            turn.graph_html = await asyncio.to_thread(render_graph, turn.cypher, turn.version, turn.graph_data)
+            yield turn.step()
         else:
-            print("【System】Judged as a Design question, answered using the reasoning assistant.")
-            answer = general_qa_chain.invoke({
-                "question": question,
-                "history": history
-            })
+            await run_neo4j_call(turn.prepare_general)
+            if turn.result:
+                yield turn.step()
 
-        result = answer.content
+        if turn.answer_request is not None:
+            async for partial in astream_answer(*turn.answer_request):
+                yield turn.add_partial(partial)
+
+        if turn.validate_answer and await asyncio.to_thread(turn.validate):
+            yield turn.step()
 
     except Exception as e:
-        print(f"【Error】Errors in dealing with problems: {str(e)}")
-        result = "Sorry, there was an error processing your question. Please try asking the question again or ask a different question."
+        if speculation is not None:
+            speculation.cancel()
+        turn.fail(e)
+        yield turn.step()
+
+    turn.finish()
 
-    memory.save_context({"input": question}, {"output": result})
+async def asmart_qa_system(question, session_id=None, details=None):
+    result, graph_html = "", None
+    async for result, graph_html in astream_smart_qa_system(question, session_id, details):
+        pass
     return result, graph_html
 
+RENDER_STATIC_LAYOUT_THRESHOLD = int(os.getenv("RENDER_STATIC_LAYOUT_THRESHOLD", "80"))
+HUB_DEGREE_THRESHOLD = int(os.getenv("HUB_DEGREE_THRESHOLD", "25"))
+LAYER_SPACING = 260
+NODE_SPACING = 70
+
+class GraphElements:
+    # Collects nodes and edges with the pyvis add_node/add_edge interface, deduplicating edges in O(1)
+
+    def __init__(self):
+        self.nodes = OrderedDict()
+        self.edges = OrderedDict()
+
+    def add_node(self, n_id, label=None, color="#97c2fc", shape="dot", **options):
+        if n_id not in self.nodes:
+            self.nodes[n_id] = dict(options, id=n_id, label=label or n_id, color=color, shape=shape)
+
+    def add_edge(self, source, to, **options):
+        key = (source, to, options.get("label", ""))
+        if key not in self.edges:
+            self.edges[key] = dict(options, **{"from": source, "to": to, "arrows": "to"})
+
+    def load_into(self, net):
+        # Bulk load: pyvis add_node/add_edge scan every existing node per call
+        net.nodes = list(self.nodes.values())
+        net.node_ids = list(self.nodes.keys())
+        net.node_map = dict(self.nodes)
+        net.edges = list(self.edges.values())
+
+def collapse_hub_nodes(elements, max_degree=HUB_DEGREE_THRESHOLD):
+    neighbours = {node_id: set() for node_id in elements.nodes}
+    for source, to, _ in elements.edges:
+        neighbours[source].add(to)
+        neighbours[to].add(source)
+
+    for hub, hub_neighbours in neighbours.items():
+        if hub not in elements.nodes or len(hub_neighbours) <= max_degree:
+            continue
+        leaves = sorted(n for n in hub_neighbours if len(neighbours[n]) == 1 and n in elements.nodes)
+        if len(leaves) < 2:
+            continue
+
+        leaf_set = set(leaves)
+        outgoing = any(source == hub and to in leaf_set for source, to, _ in elements.edges)
+        for key in [k for k in elements.edges if k[0] in leaf_set or k[1] in leaf_set]:
+            del elements.edges[key]
+        for leaf in leaves:
+            del elements.nodes[leaf]
+
+        group_id = f"{hub} (+{len(leaves)})"
+        elements.add_node(group_id, label=f"+{len(leaves)} more", color="#d9d9d9", shape="ellipse",
+                          title="\n".join(leaves))
+        if outgoing:
+            elements.add_edge(hub, group_id, color="#666666")
+        else:
+            elements.add_edge(group_id, hub, color="#666666")
+
+def layered_layout(elements):
+    successors = {node_id: [] for node_id in elements.nodes}
+    in_degree = {node_id: 0 for node_id in elements.nodes}
+    for source, to, _ in elements.edges:
+        successors[source].append(to)
+        in_degree[to] += 1
+
+    # Longest-path layering over a topological order; nodes on cycles keep the layer reached so far
+    layer = {node_id: 0 for node_id in elements.nodes}
+    queue = [node_id for node_id, degree in in_degree.items() if degree == 0]
+    for node_id in queue:
+        for to in successors[node_id]:
+            layer[to] = max(layer[to], layer[node_id] + 1)
+            in_degree[to] -= 1
+            if in_degree[to] == 0:
+                queue.append(to)
+
+    layers = {}
+    for node_id in elements.nodes:
+        layers.setdefault(layer[node_id], []).append(node_id)
+
+    # One barycenter pass keeps connected nodes roughly level with each other
+    predecessors = {node_id: [] for node_id in elements.nodes}
+    for source, to, _ in elements.edges:
+        predecessors[to].append(source)
+    position = {}
+    for depth in sorted(layers):
+        members = layers[depth]
+        members.sort(key=lambda n: sum(position.get(p, 0) for p in predecessors[n]) / max(len(predecessors[n]), 1))
+        for index, node_id in enumerate(members):
+            position[node_id] = index
+
+    for depth, members in layers.items():
+        offset = (len(members) - 1) * NODE_SPACING / 2
+        for index, node_id in enumerate(members):
+            elements.nodes[node_id].update(x=depth * LAYER_SPACING, y=index * NODE_SPACING - offset, physics=False)
+
 def generate_graph_html(graph_data):
+    from pyvis.network import Network
 
     net = Network(height="750px", width="100%", directed=True, notebook=False)
+    elements = GraphElements()
     node_records = {}
 
     data_format = detect_data_format(graph_data)
@@ -194,9 +1300,16 @@ def generate_graph_html(graph_data):
 
     handler = format_handlers.get(data_format)
     if handler:
-        handler(net, graph_data, node_records)
+        handler(elements, graph_data, node_records)
 
-    configure_network(net)
+    # Large results get a server-side layout instead of client-side physics
+    static_layout = len(elements.nodes) > RENDER_STATIC_LAYOUT_THRESHOLD
+    if static_layout:
+        collapse_hub_nodes(elements)
+        layered_layout(elements)
+
+    elements.load_into(net)
+    configure_network(net, static_layout)
     return save_network(net)
 
 def add_node_if_absent(net, node_records, node_id, label=None, color="#97c2fc", shape="box"):
@@ -294,7 +1407,29 @@ def detect_data_format(data):
             return "D"
     return "A"
 
-def configure_network(net):
+def configure_network(net, static_layout=False):
+    if static_layout:
+        net.toggle_physics(False)
+        net.set_options("""
+        {
+            "physics": {
+                "enabled": false
+            },
+            "layout": {
+                "improvedLayout": false
+            },
+            "edges": {
+                "smooth": false
+            },
+            "nodes": {
+                "font": {
+                    "size": 14
+                }
+            }
+        }
+        """)
+        return
+
     net.toggle_physics(True)
     net.set_options("""
     {
@@ -316,17 +1451,27 @@ def configure_network(net):
     """)
 
 def save_network(net):
-    static_dir = os.path.join(os.getcwd(), "static")
-    os.makedirs(static_dir, exist_ok=True)
-    filename = f"graph_{uuid.uuid4().hex}.html"
-    filepath = os.path.join(static_dir, filename)
-    net.save_graph(filepath)
-    return f"/static/{filename}"
+    graph_id = visualization_store.put(net.generate_html())
+    return f"{GRAPH_ROUTE}{graph_id}"
 
 def get_graph_html(data):
+    from pyvis.network import Network
     net = Network(height='500px', width='100%', notebook=False, directed=True)
     for item in data:
         r = item.get('r', {})
         name = r.get('name', 'Unknown')
         net.add_node(name, label=name)
-    return net.generate_html()
\ No newline at end of file
+    return net.generate_html()
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Design-on-Graph utilities")
+    parser.add_argument("--save-schema-snapshot", metavar="PATH",
+                        help="Introspect the live Neo4j schema and save it for GRAPH_SCHEMA_SNAPSHOT")
+    args = parser.parse_args()
+
+    if args.save_schema_snapshot:
+        configure_components(schema_snapshot=None)
+        save_schema_snapshot(args.save_schema_snapshot)
+        print(f"【System】Graph schema snapshot saved to {args.save_schema_snapshot}")
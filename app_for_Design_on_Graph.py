@@ -1,52 +1,24 @@
 import gradio as gr
-from Design_on_Graph import smart_qa_system
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import HTMLResponse, PlainTextResponse
+from Design_on_Graph import astream_smart_qa_system, visualization_store, warm_graph_index, GRAPH_ROUTE
+from metrics_for_Design_on_Graph import metrics
 import os
-import time
-from pathlib import Path
-import urllib.parse
 
-def clean_old_graphs(static_folder="static", max_age=3600):
-    current_time = time.time()
-    static_path = Path(static_folder)
-
-    if not static_path.exists():
-        return
-
-    for html_file in static_path.glob("graph_*.html"):
-        file_age = current_time - html_file.stat().st_mtime
-        if file_age > max_age:  # 删除超过1小时的旧文件
-            try:
-                html_file.unlink()
-            except Exception as e:
-                print(f"Error deleting {html_file}: {e}")
-
-def get_graph_file_url(graph_html_path):
-    if not graph_html_path:
-        return None
-
-    full_path = Path(os.getcwd()) / graph_html_path.lstrip("/")
-
-    if not full_path.exists():
-        return None
-
-    return f"file/{urllib.parse.quote(str(full_path))}"
+APP_CONCURRENCY = int(os.getenv("APP_CONCURRENCY", "32"))
 
 def get_graph_html_content(graph_html_path):
-    if not graph_html_path:
+    if not graph_html_path or not graph_html_path.startswith(GRAPH_ROUTE):
         return "..."
 
-    full_path = Path(os.getcwd()) / graph_html_path.lstrip("/")
-
-    if not full_path.exists():
+    if not visualization_store.contains(graph_html_path[len(GRAPH_ROUTE):]):
         return "..."
 
-    with open(full_path, "r", encoding="utf-8") as f:
-        html_content = f.read()
-
+    # The browser fetches the rendering by reference instead of receiving it inline
     return f"""
     <div style='width: 100%; height: 650px; border: 1px solid #ccc; overflow: hidden;'>
         <iframe 
-            srcdoc="{html_content.replace('"', '&quot;')}"
+            src="{graph_html_path}"
             style="width: 100%; height: 100%; border: none;"
         ></iframe>
     </div>
@@ -118,19 +90,25 @@ Use the conversation history to determine the full list of operations, their typ
         gr.Button("Check").click(
             lambda: "This is a general question: check whether the generated automatic and manual schemes meet the predecessor requirements between operations. If not, please regenerate.", None, user_input)
 
-    def handle_chat(user_message, history):
-        clean_old_graphs()
-
-        response, graph_html_path = smart_qa_system(user_message)
+    async def handle_chat(user_message, history, request: gr.Request):
+        messages = history + [{"role": "user", "content": user_message}]
+        yield messages, gr.update()
 
-        graph_html_content = get_graph_html_content(graph_html_path)
+        # Only send the graph panel again when the visualization changes, not on every token
+        shown_graph_path = object()
+        # Each browser session keeps its own conversation memory
+        session_id = request.session_hash if request else None
+        async for response, graph_html_path in astream_smart_qa_system(user_message, session_id):
+            graph_html_content = gr.update()
+            if graph_html_path != shown_graph_path:
+                graph_html_content = get_graph_html_content(graph_html_path)
+                shown_graph_path = graph_html_path
 
-        updated_messages = history + [
-            {"role": "user", "content": user_message},
-            {"role": "assistant", "content": response}
-        ]
+            updated_messages = messages + [
+                {"role": "assistant", "content": response}
+            ]
 
-        return updated_messages, graph_html_content
+            yield updated_messages, graph_html_content
 
 
     send_btn.click(
@@ -150,13 +128,33 @@ Use the conversation history to determine the full list of operations, their typ
         outputs=[chatbot, graph_html]
     )
 
+demo.queue(default_concurrency_limit=APP_CONCURRENCY)
+
+app = FastAPI()
+
+@app.get(GRAPH_ROUTE + "{graph_id}", response_class=HTMLResponse)
+def serve_graph(graph_id: str):
+    html_content = visualization_store.get(graph_id)
+    if html_content is None:
+        raise HTTPException(status_code=404, detail="Graph expired or not found")
+    return HTMLResponse(html_content)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def serve_metrics():
+    # Prometheus text exposition format
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+app = gr.mount_gradio_app(app, demo, path="/")
+
 if __name__ == "__main__":
-    static_dir = os.path.join(os.getcwd(), "static")
-    if not os.path.exists(static_dir):
-        os.makedirs(static_dir)
-
-    demo.launch(
-        server_name="localhost",
-        server_port=7860,
-        share=False
-    )
\ No newline at end of file
+    import threading
+    import uvicorn
+
+    # Load the graph index in the background so the first questions can already use it
+    threading.Thread(target=warm_graph_index, daemon=True).start()
+
+    uvicorn.run(
+        app,
+        host="localhost",
+        port=7860
+    )
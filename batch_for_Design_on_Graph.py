@@ -0,0 +1,175 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+
+import Design_on_Graph as core
+from cache_for_Design_on_Graph import fingerprint_text
+
+BATCH_SESSION_ID = "batch"
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "4"))
+
+# Conservative requests per second for each model, overridden by MODEL_RATE_LIMITS and --rate-limit
+DEFAULT_RATE_LIMITS = {
+    "gpt-4o-mini": 5.0,
+    "gpt-4o": 2.0,
+    "o1-preview": 0.5
+}
+
+
+def load_questions(path):
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    if path.endswith(".json"):
+        items = json.loads(text)
+    elif path.endswith(".jsonl"):
+        items = [json.loads(line) for line in text.splitlines() if line.strip()]
+    else:
+        # One question per line, blank lines and # comments are skipped
+        items = [line.strip() for line in text.splitlines() if line.strip() and not line.lstrip().startswith("#")]
+    return [item["question"] if isinstance(item, dict) else str(item) for item in items]
+
+
+def deduplicate(questions):
+    unique = OrderedDict()
+    for question in questions:
+        unique.setdefault(core.normalize_question(question), question)
+    return list(unique.values())
+
+
+def load_done(path):
+    # The latest successful record of each question, in the order they were written
+    done = OrderedDict()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by an interruption, the question runs again
+                continue
+            key = core.normalize_question(record.get("question", ""))
+            if record.get("status") == "ok":
+                done.pop(key, None)
+                done[key] = record
+    return done
+
+
+def rehydrate(session, records):
+    # Replay finished answers so design questions still see the knowledge of earlier graph answers
+    for record in records:
+        if record.get("route") == "graph" and isinstance(record.get("graph_data"), list):
+            session.knowledge.ingest(record["graph_data"])
+        session.record(record["question"], record["answer"], record.get("route"))
+
+
+def save_visualization(graph_ref, directory, question):
+    html = core.load_graph_html(graph_ref)
+    if html is None:
+        return None
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, fingerprint_text(core.normalize_question(question))[:16] + ".html")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(html)
+    return path
+
+
+class ResultWriter:
+
+    def __init__(self, path, restart=False):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(path, "w" if restart else "a", encoding="utf-8")
+
+    def write(self, record):
+        # Flushed per record so an interrupted batch keeps everything finished so far
+        self.file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+async def run_question(question, visualization_dir):
+    details = {}
+    start_time = time.perf_counter()
+    answer, graph_ref = await core.asmart_qa_system(question, BATCH_SESSION_ID, details)
+    return {
+        "question": question,
+        "route": details.get("route"),
+        "cypher": details.get("cypher"),
+        "graph_data": details.get("graph_data"),
+        "answer": answer,
+        "visualization": save_visualization(graph_ref, visualization_dir, question),
+        "status": details.get("status", "error"),
+        "duration": round(time.perf_counter() - start_time, 3)
+    }
+
+
+async def run_batch(questions, writer, visualization_dir, workers=BATCH_WORKERS):
+    workers = asyncio.Semaphore(max(workers, 1))
+    counts = {"ok": 0, "error": 0}
+
+    async def bounded(coroutine):
+        async with workers:
+            return await coroutine
+
+    def finish(record):
+        writer.write(record)
+        counts[record["status"]] = counts.get(record["status"], 0) + 1
+        print(f"【System】[{sum(counts.values())}/{len(questions)}] {record['status']} ({record['route']}): "
+              f"{record['question'][:80]}")
+
+    routes = await asyncio.gather(*(bounded(core.aroute_question(question)) for question in questions))
+    graph_questions = [q for q, route in zip(questions, routes) if route == "graph"]
+    general_questions = [q for q, route in zip(questions, routes) if route != "graph"]
+
+    # Graph questions are independent of each other and run side by side
+    for task in asyncio.as_completed([bounded(run_question(q, visualization_dir)) for q in graph_questions]):
+        finish(await task)
+
+    # Design questions build on the conversation, so they run afterwards and in file order
+    for question in general_questions:
+        finish(await run_question(question, visualization_dir))
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Answer a file of questions with Design-on-Graph and write JSONL")
+    parser.add_argument("questions", help="Text file with one question per line, or a .json/.jsonl list")
+    parser.add_argument("--output", default="batch_results.jsonl")
+    parser.add_argument("--visualizations", help="Directory for the graph HTML files (default: next to the output)")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS)
+    parser.add_argument("--rate-limit", action="append", default=[], metavar="MODEL=RPS",
+                        help="Requests per second for a model, e.g. gpt-4o=2 (repeatable)")
+    parser.add_argument("--restart", action="store_true", help="Ignore and overwrite previous results")
+    args = parser.parse_args(argv)
+
+    rate_limits = dict(DEFAULT_RATE_LIMITS, **core.MODEL_RATE_LIMITS)
+    rate_limits.update(core.parse_rate_limits(",".join(args.rate_limit)))
+    core.configure_components(rate_limits=rate_limits)
+    visualization_dir = args.visualizations or os.path.splitext(args.output)[0] + "_graphs"
+
+    questions = deduplicate(load_questions(args.questions))
+    done = {} if args.restart else load_done(args.output)
+    rehydrate(core.sessions.get(BATCH_SESSION_ID), done.values())
+    pending = [q for q in questions if core.normalize_question(q) not in done]
+    print(f"【System】{len(questions)} unique questions, {len(questions) - len(pending)} already answered, "
+          f"{len(pending)} to run")
+
+    writer = ResultWriter(args.output, restart=args.restart)
+    try:
+        counts = asyncio.run(run_batch(pending, writer, visualization_dir, args.workers))
+    finally:
+        writer.close()
+    print(f"【System】Batch finished: {counts['ok']} answered, {counts['error']} failed, results in {args.output}")
+    return 1 if counts["error"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
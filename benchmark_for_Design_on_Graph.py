@@ -0,0 +1,341 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Optional
+
+from langchain_community.graphs.graph_store import GraphStore
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+BENCHMARK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark")
+FIXTURE_PATH = os.path.join(BENCHMARK_DIR, "ontology_fixture.json")
+THRESHOLDS_PATH = os.path.join(BENCHMARK_DIR, "thresholds.json")
+
+# The example buttons of the app, with the canonical query each graph question is answered by
+WORKLOAD = [
+    ("List the subprocess of each process.", "processes"),
+    ("List all information of operations. Merge information according to manual and automatic.", "operations"),
+    ("List all information of resources.", "resources"),
+    ("Search all relationships between operations and resources. List all names of operations, names of resources, "
+     "and number of need resources. Merge information according to the operation.", "requirements"),
+    ("List all predecessors of each operation.", "predecessors"),
+    ("This is a general question. Please help me design a complete aircraft fuselage assembly scheme that includes "
+     "the assembly of four 1/4 bodies, using both automatic and manual methods. Your plan should follow these "
+     "specific constraints:\n1. The first two operations must be \"S40_00001_Jig in\" and \"S40_01001_Set up working "
+     "environment\", and the last operation must be \"S40_00002_Jig out\".\n2. \"S40_04012_Deburring int, positioning, "
+     "attach them automatic\" (automatic) or \"S40_04013_Deburring int, positioning, attach them manual\" (manual) "
+     "marks the completion of one 1/4 aircraft fuselage assembly.", None),
+    ("This is a general question: check whether the generated automatic and manual schemes meet the predecessor "
+     "requirements between operations. If not, please regenerate.", None)
+]
+
+
+class FakeChatModel(BaseChatModel):
+    latency: float = 0.0
+    token_latency: float = 0.0
+    tokens: int = 50
+    responder: Optional[Callable[[str], Optional[str]]] = None
+
+    @property
+    def _llm_type(self):
+        return "benchmark-fake"
+
+    def respond(self, messages):
+        prompt = "\n".join(str(message.content) for message in messages)
+        text = self.responder(prompt) if self.responder else None
+        return text if text is not None else " ".join(f"token{i}" for i in range(self.tokens))
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        text = self.respond(messages)
+        time.sleep(self.latency + self.token_latency * len(text.split(" ")))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        text = self.respond(messages)
+        await asyncio.sleep(self.latency + self.token_latency * len(text.split(" ")))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        for piece in self.respond(messages).split(" "):
+            time.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece + " "))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        for piece in self.respond(messages).split(" "):
+            await asyncio.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=piece + " "))
+
+
+class FixtureGraph(GraphStore):
+    # Answers the known queries from the fixture instead of running Cypher
+
+    def __init__(self, fixture, results, latency=0.0):
+        self.fixture = fixture
+        self.results = results
+        self.latency = latency
+        self.structured_schema = fixture["schema"]
+        self.schema = json.dumps(fixture["schema"])
+        self.queries = 0
+
+    @property
+    def get_schema(self):
+        return self.schema
+
+    @property
+    def get_structured_schema(self):
+        return self.structured_schema
+
+    def query(self, query, params={}):
+        self.queries += 1
+        time.sleep(self.latency)
+        return [dict(row) for row in self.results.get(query.strip(), [])]
+
+    def refresh_schema(self):
+        pass
+
+    def add_graph_documents(self, graph_documents, include_source=False):
+        raise NotImplementedError("The fixture graph is read-only")
+
+
+def fixture_results(fixture, queries, version_query):
+    operations = fixture["operations"]
+    rows = {
+        "operations": [{"operation": op["name"], "operation_type": op["type"], "operation_duration": op["duration"]}
+                       for op in operations],
+        "predecessors": [{"operation": op["name"], "predecessor": pred}
+                         for op in operations for pred in op["predecessors"]],
+        "requirements": [{"operation": op["name"], "resource": name, "resource_number": number}
+                         for op in operations for name, number in op["resources"].items()],
+        "resources": [{"resource": res["name"], "resource_cost": res["cost"], "resource_calendar": res["calendar"],
+                       "resource_quantity": res["quantity"]} for res in fixture["resources"]],
+        "processes": [{"process": process, "subprocess": subprocess}
+                      for process, subprocesses in fixture["processes"].items() for subprocess in subprocesses]
+    }
+    results = {queries[name].strip(): value for name, value in rows.items() if name in queries}
+    results[version_query.strip()] = [{"nodes": len(operations) + len(fixture["resources"]),
+                                       "relationships": len(rows["predecessors"]) + len(rows["requirements"])}]
+    return results
+
+
+def synthetic_results(size):
+    # Large result sets in the shapes the renderer distinguishes
+    return {
+        "chain": [{"operation": f"S40_9{i:04d}_Synthetic operation {i}",
+                   "predecessor": f"S40_9{i - 1:04d}_Synthetic operation {i - 1}"} for i in range(1, size + 1)],
+        "resources": [{"operation": f"S40_9{i:04d}_Synthetic operation {i}", "resource": f"Resource {i % 12}",
+                       "number": 1 + i % 3} for i in range(size)],
+        "attributes": [{"o": {"name": f"S40_9{i:04d}_Synthetic operation {i}", "type": "Manual" if i % 2 else "Automatic",
+                              "duration": 10 + i % 50}} for i in range(size)]
+    }
+
+
+def cypher_responder(workload_cypher):
+    def respond(prompt):
+        if "The question is:" in prompt:
+            question = prompt.rsplit("The question is:", 1)[1].strip()
+            return workload_cypher.get(question, "MATCH (n) RETURN n LIMIT 1")
+        if "intelligent routing assistant" in prompt:
+            return "graph"
+        return None
+    return respond
+
+
+def summarize(durations):
+    durations = sorted(durations)
+    return {
+        "count": len(durations),
+        "mean_ms": round(statistics.mean(durations) * 1000, 3),
+        "p50_ms": round(durations[len(durations) // 2] * 1000, 3),
+        "p95_ms": round(durations[min(len(durations) - 1, int(len(durations) * 0.95))] * 1000, 3),
+        "max_ms": round(durations[-1] * 1000, 3)
+    }
+
+
+def reset_caches(core):
+    core.result_cache.clear()
+    core.cypher_cache.clear()
+    with core.route_cache_lock:
+        core.route_cache.clear()
+
+
+def measure(durations, func, *args):
+    start_time = time.perf_counter()
+    value = func(*args)
+    durations.setdefault(func.__name__, []).append(time.perf_counter() - start_time)
+    return value
+
+
+def drain(stream):
+    result = None
+    for result in stream:
+        pass
+    return result
+
+
+def run_stages(core, iterations, synthetic):
+    stages = {}
+    use_graph_index = core.USE_GRAPH_INDEX
+    for _ in range(iterations):
+        reset_caches(core)
+        for question, canonical in WORKLOAD:
+            route = measure(stages, core.route_question, question)
+            if route != "graph" or canonical is None:
+                continue
+            # The cypher stage times generation and execution, which the index would otherwise answer for
+            core.USE_GRAPH_INDEX = False
+            try:
+                cypher, graph_data, version = measure(stages, core.run_cypher_query, question)
+            finally:
+                core.USE_GRAPH_INDEX = use_graph_index
+            if use_graph_index:
+                measure(stages, core.lookup_graph_index, question, version)
+            measure(stages, core.generate_graph_html, graph_data)
+            chain, inputs, _ = core.graph_answer_request(question, cypher, graph_data, version)
+            measure(stages, drain, core.stream_answer(chain, inputs))
+
+        for name, graph_data in synthetic.items():
+            measure(stages, core.detect_data_format, graph_data)
+            for stage, func in (("render_" + name, core.generate_graph_html),
+                                ("serialize_" + name, core.serialize_graph_data)):
+                start_time = time.perf_counter()
+                func(graph_data)
+                stages.setdefault(stage, []).append(time.perf_counter() - start_time)
+
+    renamed = {"route_question": "route", "run_cypher_query": "cypher", "lookup_graph_index": "graph_index",
+               "generate_graph_html": "render", "drain": "answer"}
+    return {renamed.get(name, name): summarize(values) for name, values in stages.items()}
+
+
+def run_pipeline(core, iterations):
+    cold, warm = [], []
+    errors = 0
+    tracemalloc.start()
+    for iteration in range(iterations):
+        reset_caches(core)
+        for durations in (cold, warm):
+            session_id = f"benchmark-{iteration}-{len(durations)}"
+            for question, _ in WORKLOAD:
+                start_time = time.perf_counter()
+                result, _ = core.smart_qa_system(question, session_id)
+                durations.append(time.perf_counter() - start_time)
+                errors += result == core.ERROR_ANSWER
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"cold": summarize(cold), "warm": summarize(warm), "errors": errors}, peak
+
+
+async def run_concurrent(core, concurrency, rounds):
+    async def user(index):
+        for round_index in range(rounds):
+            for question, _ in WORKLOAD:
+                await core.asmart_qa_system(question, f"concurrent-{index}-{round_index}")
+
+    reset_caches(core)
+    start_time = time.perf_counter()
+    await asyncio.gather(*(user(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - start_time
+    questions = concurrency * rounds * len(WORKLOAD)
+    return {"concurrency": concurrency, "questions": questions, "seconds": round(elapsed, 3),
+            "throughput_qps": round(questions / elapsed, 3)}
+
+
+def check_thresholds(report, thresholds):
+    regressions = []
+    for stage, limits in thresholds.get("stages", {}).items():
+        for metric, limit in limits.items():
+            value = report["stages"].get(stage, {}).get(metric)
+            if value is not None and value > limit:
+                regressions.append(f"{stage} {metric} {value} > {limit}")
+    if report["pipeline"]["errors"] > thresholds.get("errors_max", 0):
+        regressions.append(f"{report['pipeline']['errors']} pipeline answers failed")
+    for mode, limits in thresholds.get("pipeline", {}).items():
+        for metric, limit in limits.items():
+            value = report["pipeline"][mode][metric]
+            if value > limit:
+                regressions.append(f"pipeline {mode} {metric} {value} > {limit}")
+    minimum = thresholds.get("throughput_qps_min")
+    if minimum is not None and report["concurrency"]["throughput_qps"] < minimum:
+        regressions.append(f"throughput {report['concurrency']['throughput_qps']} qps < {minimum}")
+    maximum = thresholds.get("peak_memory_mb_max")
+    if maximum is not None and report["peak_memory_mb"] > maximum:
+        regressions.append(f"peak memory {report['peak_memory_mb']} MB > {maximum}")
+    return regressions
+
+
+def run_benchmark(args):
+    with open(args.fixture, "r", encoding="utf-8") as f:
+        fixture = json.load(f)
+
+    # Caches go to a scratch directory so benchmark runs never touch the real ones
+    scratch = tempfile.mkdtemp(prefix="dog-benchmark-")
+    os.environ["CYPHER_CACHE_PATH"] = os.path.join(scratch, "cypher_cache.json")
+    import Design_on_Graph as core
+    from knowledge_for_Design_on_Graph import load_canonical_queries
+
+    queries = load_canonical_queries()
+    graph = FixtureGraph(fixture, fixture_results(fixture, queries, core.GRAPH_VERSION_QUERY), args.neo4j_latency)
+    workload_cypher = {question: queries[canonical] for question, canonical in WORKLOAD if canonical}
+    model_options = {"latency": args.llm_latency, "token_latency": args.token_latency, "tokens": args.answer_tokens,
+                     "responder": cypher_responder(workload_cypher)}
+    core.configure_components(schema_snapshot=None, graph=graph, llm=FakeChatModel(**model_options),
+                              llm_2=FakeChatModel(**model_options), llm_3=FakeChatModel(**model_options))
+    core.graph_version_state.update(version=None, checked_at=0.0)
+
+    report = {"settings": {k: v for k, v in vars(args).items() if k not in ("output", "thresholds")}}
+    synthetic = synthetic_results(args.synthetic_rows)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        # One-off imports of the rendering and chain libraries are not part of any stage
+        core.generate_graph_html(synthetic["chain"][:2])
+        core.components.cypher_chain
+        core.warm_graph_index()
+        report["stages"] = run_stages(core, args.iterations, synthetic)
+        report["pipeline"], peak = run_pipeline(core, args.iterations)
+        report["concurrency"] = asyncio.run(run_concurrent(core, args.concurrency, args.iterations))
+    report["peak_memory_mb"] = round(peak / (1024 * 1024), 3)
+    report["neo4j_queries"] = graph.queries
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline Design-on-Graph benchmark with fake LLM and Neo4j stand-ins")
+    parser.add_argument("--fixture", default=FIXTURE_PATH)
+    parser.add_argument("--thresholds", default=THRESHOLDS_PATH)
+    parser.add_argument("--output")
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--synthetic-rows", type=int, default=300)
+    parser.add_argument("--llm-latency", type=float, default=0.0)
+    parser.add_argument("--token-latency", type=float, default=0.0)
+    parser.add_argument("--answer-tokens", type=int, default=200)
+    parser.add_argument("--neo4j-latency", type=float, default=0.0)
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(args)
+    thresholds = {}
+    if args.thresholds and os.path.exists(args.thresholds):
+        with open(args.thresholds, "r", encoding="utf-8") as f:
+            thresholds = json.load(f)
+    report["regressions"] = check_thresholds(report, thresholds)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+    for regression in report["regressions"]:
+        print(f"【Error】Regression: {regression}", file=sys.stderr)
+    return 1 if report["regressions"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,282 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+def fingerprint_text(text):
+    return hashlib.sha256(str(text).encode("utf-8")).hexdigest()[:16]
+
+
+class CypherCache:
+
+    def __init__(self, path, max_entries=512):
+        self.path = path
+        self.max_entries = max_entries
+        self.schema_fingerprint = None
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                payload = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"【Cache】Ignoring unreadable Cypher cache {self.path}: {e}")
+            return
+        self.schema_fingerprint = payload.get("schema_fingerprint")
+        self.entries = OrderedDict(payload.get("entries", []))
+
+    def save(self):
+        if not self.path:
+            return
+        payload = {
+            "schema_fingerprint": self.schema_fingerprint,
+            "entries": list(self.entries.items())
+        }
+        # The app and the batch runner may share the file, so each save writes its own temporary file
+        directory = os.path.dirname(self.path)
+        tmp_path = None
+        try:
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory or ".", prefix=os.path.basename(self.path) + ".",
+                                            suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(payload, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            # The cache is only an optimization, a failed save never fails the question
+            print(f"【Cache】Cannot save the Cypher cache {self.path}: {e}")
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def check_schema(self, schema_fingerprint):
+        # Generated Cypher is only valid for the schema it was generated against
+        if schema_fingerprint != self.schema_fingerprint:
+            if self.entries:
+                print("【Cache】Graph schema changed, Cypher cache invalidated")
+            self.entries.clear()
+            self.schema_fingerprint = schema_fingerprint
+            return False
+        return True
+
+    def get(self, question_key, schema_fingerprint):
+        with self.lock:
+            if not self.check_schema(schema_fingerprint):
+                self.save()
+                return None
+            cypher = self.entries.get(question_key)
+            if cypher is not None:
+                self.entries.move_to_end(question_key)
+            return cypher
+
+    def put(self, question_key, schema_fingerprint, cypher):
+        with self.lock:
+            self.check_schema(schema_fingerprint)
+            self.entries[question_key] = cypher
+            self.entries.move_to_end(question_key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.save()
+
+    def discard(self, question_key):
+        with self.lock:
+            if self.entries.pop(question_key, None) is not None:
+                self.save()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.save()
+
+
+class FlightAbandoned(Exception):
+    pass
+
+
+class ResultCache:
+
+    def __init__(self, ttl=1800, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.inflight = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.time():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.time() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def begin(self, key):
+        with self.lock:
+            entry = self.lookup(key)
+            if entry is not None:
+                self.hits += 1
+                return "hit", entry[1]
+            flight = self.inflight.get(key)
+            if flight is not None:
+                self.hits += 1
+                return "wait", flight
+            self.misses += 1
+            flight = Future()
+            self.inflight[key] = flight
+            return "lead", flight
+
+    def finish(self, key, value):
+        self.put(key, value)
+        with self.lock:
+            flight = self.inflight.pop(key, None)
+        if flight is not None:
+            flight.set_result(value)
+
+    def abandon(self, key, error):
+        with self.lock:
+            flight = self.inflight.pop(key, None)
+        if flight is not None:
+            if not isinstance(error, Exception):
+                # A closed stream or cancelled task only stops its own request, the waiters compute the value instead
+                error = FlightAbandoned(f"The request computing this value stopped: {type(error).__name__}")
+            flight.set_exception(error)
+
+    def get_or_compute(self, key, compute):
+        state, value = self.begin(key)
+        while state == "wait":
+            # Concurrent identical requests wait for the first one instead of recomputing
+            try:
+                return value.result()
+            except FlightAbandoned:
+                state, value = self.begin(key)
+        if state == "hit":
+            return value
+
+        try:
+            result = compute()
+        except BaseException as e:
+            self.abandon(key, e)
+            raise
+        self.finish(key, result)
+        return result
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class VisualizationStore:
+
+    def __init__(self, ttl=3600, max_bytes=64 * 1024 * 1024, spill_dir=None, expiry_interval=60):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.expiry_interval = expiry_interval
+        self.entries = OrderedDict()
+        self.spilled = {}
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.expiry_thread = None
+        self.stopped = threading.Event()
+
+    def spill_path(self, graph_id):
+        return os.path.join(self.spill_dir, f"graph_{graph_id}.html")
+
+    def put(self, html, graph_id=None):
+        graph_id = graph_id or uuid.uuid4().hex
+        size = len(html.encode("utf-8"))
+        with self.lock:
+            self.entries[graph_id] = (time.time() + self.ttl, html, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                self.evict_oldest()
+        self.start_expiry()
+        return graph_id
+
+    def evict_oldest(self):
+        graph_id, (expires_at, html, size) = self.entries.popitem(last=False)
+        self.total_bytes -= size
+        if self.spill_dir and expires_at > time.time():
+            # Keep still-valid renderings on disk instead of dropping them
+            os.makedirs(self.spill_dir, exist_ok=True)
+            with open(self.spill_path(graph_id), "w", encoding="utf-8") as f:
+                f.write(html)
+            self.spilled[graph_id] = expires_at
+
+    def get(self, graph_id):
+        with self.lock:
+            entry = self.entries.get(graph_id)
+            if entry is not None:
+                if entry[0] >= time.time():
+                    self.entries.move_to_end(graph_id)
+                    return entry[1]
+                return None
+            expires_at = self.spilled.get(graph_id)
+        if expires_at is None or expires_at < time.time():
+            return None
+        try:
+            with open(self.spill_path(graph_id), "r", encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def contains(self, graph_id):
+        with self.lock:
+            entry = self.entries.get(graph_id)
+            if entry is not None:
+                return entry[0] >= time.time()
+            return self.spilled.get(graph_id, 0) >= time.time()
+
+    def expire(self):
+        now = time.time()
+        with self.lock:
+            for graph_id in [k for k, v in self.entries.items() if v[0] < now]:
+                self.total_bytes -= self.entries.pop(graph_id)[2]
+            expired_spills = [k for k, v in self.spilled.items() if v < now]
+            for graph_id in expired_spills:
+                del self.spilled[graph_id]
+        for graph_id in expired_spills:
+            try:
+                os.remove(self.spill_path(graph_id))
+            except OSError:
+                pass
+
+    def start_expiry(self):
+        if self.expiry_thread is not None:
+            return
+        with self.lock:
+            if self.expiry_thread is not None:
+                return
+            self.expiry_thread = threading.Thread(
+                target=self.run_expiry, name="visualization-expiry", daemon=True
+            )
+        self.expiry_thread.start()
+
+    def run_expiry(self):
+        while not self.stopped.wait(self.expiry_interval):
+            self.expire()
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,143 @@
+import json
+import re
+from collections import Counter, OrderedDict
+
+PREFIX_MARKER = "~"
+MAX_PREFIXES = 3
+MIN_PREFIX_LENGTH = 4
+CELL_SEPARATOR = " | "
+IDENTIFIER_CODE = re.compile(r"^[A-Za-z0-9]+_\d+")
+
+token_encoder = {}
+
+
+def count_tokens(text, model="gpt-4o"):
+    if model not in token_encoder:
+        try:
+            import tiktoken
+            token_encoder[model] = tiktoken.encoding_for_model(model)
+        except Exception:
+            # No tokenizer available offline, fall back to the usual ~4 characters per token
+            token_encoder[model] = None
+    encoder = token_encoder[model]
+    if encoder is None:
+        return (len(text) + 3) // 4
+    return len(encoder.encode(text))
+
+
+def flatten_row(row, parent=""):
+    cells = OrderedDict()
+    for key, value in row.items():
+        column = f"{parent}.{key}" if parent else str(key)
+        if isinstance(value, dict):
+            cells.update(flatten_row(value, column))
+        else:
+            cells[column] = value
+    return cells
+
+
+def format_cell(value):
+    if isinstance(value, str):
+        return value.replace("\\", "\\\\").replace("|", "\\|").replace("\n", "\\n")
+    return json.dumps(value, ensure_ascii=False, default=str)
+
+
+def choose_prefixes(values):
+    # Greedily pick the code prefixes that save the most characters, e.g. "S40_0" in "S40_01001_Set up..."
+    prefixes = []
+    codes = [(v, IDENTIFIER_CODE.match(v)) for v in values]
+    remaining = [(v, m.end()) for v, m in codes if m and m.end() >= MIN_PREFIX_LENGTH]
+    for index in range(1, MAX_PREFIXES + 1):
+        marker = f"{PREFIX_MARKER}{chr(ord('A') + index - 1)}"
+        counts = Counter()
+        for value, code_length in remaining:
+            for length in range(MIN_PREFIX_LENGTH, code_length + 1):
+                counts[value[:length]] += 1
+        best, best_saving = None, 0
+        for prefix, count in counts.items():
+            saving = count * (len(prefix) - len(marker)) - len(prefix) - len(marker) - 2
+            if count > 1 and saving > best_saving:
+                best, best_saving = prefix, saving
+        if best is None:
+            break
+        prefixes.append((marker, best))
+        remaining = [(v, n) for v, n in remaining if not v.startswith(best)]
+    return prefixes
+
+
+def compress_cell(text, prefixes):
+    for marker, prefix in prefixes:
+        if text.startswith(prefix):
+            return marker + text[len(prefix):]
+    return text
+
+
+def encode_graph_data(graph_data):
+    if not isinstance(graph_data, list) or not all(isinstance(row, dict) for row in graph_data):
+        return str(graph_data)
+    if not graph_data:
+        return "No rows."
+
+    rows = [flatten_row(row) for row in graph_data]
+    columns = list(OrderedDict.fromkeys(column for row in rows for column in row))
+    missing = object()
+
+    # Columns holding one value in every row are stated once instead of per row
+    constants = OrderedDict()
+    if len(rows) > 1:
+        for column in columns:
+            first = rows[0].get(column, missing)
+            if first is not missing and all(row.get(column, missing) == first for row in rows):
+                constants[column] = first
+    columns = [column for column in columns if column not in constants]
+
+    table = []
+    for row in rows:
+        table.append(tuple(format_cell(row[c]) if c in row else "" for c in columns))
+
+    # Identical rows are listed once with their multiplicity
+    row_counts = Counter(table)
+    table = list(OrderedDict.fromkeys(table))
+
+    cells = [cell for row in table for cell in row]
+    prefixes = [] if any(PREFIX_MARKER in cell for cell in cells) else choose_prefixes(cells)
+
+    lines = []
+    if prefixes:
+        lines.append("Prefixes: " + ", ".join(f"{marker}={prefix}" for marker, prefix in prefixes))
+    # One line per constant, string values such as operation names may contain ", " themselves
+    for column, value in constants.items():
+        lines.append(f"Constant: {column}={format_cell(value)}")
+    if columns:
+        header = list(columns)
+        if any(count > 1 for count in row_counts.values()):
+            header.append("count")
+        lines.append("Columns: " + CELL_SEPARATOR.join(header))
+        lines.append(f"Rows ({len(rows)}):")
+        for row in table:
+            cells = [compress_cell(cell, prefixes) for cell in row]
+            if len(header) > len(columns):
+                cells.append(str(row_counts[row]))
+            lines.append(CELL_SEPARATOR.join(cells))
+    else:
+        lines.append(f"Rows ({len(rows)}): all identical")
+    return "\n".join(lines)
+
+
+def serialize_graph_data(graph_data, token_budget=None, model="gpt-4o"):
+    compact = encode_graph_data(graph_data)
+    raw_tokens = count_tokens(str(graph_data), model)
+    compact_tokens = count_tokens(compact, model)
+    stats = {
+        "raw_tokens": raw_tokens,
+        "compact_tokens": compact_tokens,
+        "saved_tokens": raw_tokens - compact_tokens,
+        "over_budget": bool(token_budget) and compact_tokens > token_budget
+    }
+
+    # The encoding is lossless and every value must reach the model, so whichever form is smaller wins
+    if compact_tokens >= raw_tokens:
+        compact = str(graph_data)
+        stats["compact_tokens"] = raw_tokens
+        stats["saved_tokens"] = 0
+    return compact, stats
@@ -0,0 +1,193 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from graphlib import CycleError, TopologicalSorter
+
+from knowledge_for_Design_on_Graph import KnowledgeStore, load_canonical_queries
+
+OPERATION_CODE = re.compile(r"\b[a-z]+\d+_\d+(?!\d)")
+
+# Question shapes answered from the index, each with the canonical query whose rows answer it
+INDEX_INTENTS = [
+    ("predecessor_closure", "predecessors",
+     re.compile(r"\bpredecessors?\b.*\b(transitive|indirect|upstream|recursive)|"
+                r"\b(transitive|indirect|upstream|recursive)\b.*\bpredecessors?\b")),
+    ("predecessors", "predecessors", re.compile(r"\bpredecessors?\b.*\boperations?\b|\bpredecessors? of\b")),
+    ("successors", "predecessors", re.compile(r"\bsuccessors?\b.*\boperations?\b|\bsuccessors? of\b")),
+    ("processes", "processes", re.compile(r"\bsub-?process(es)?\b.*\bprocess(es)?\b")),
+    ("requirements", "requirements",
+     re.compile(r"\boperations?\b.*\bresources?\b|\bresources?\b.*\b(operations?|[a-z]+\d+_\d+)\b"))
+]
+# "All information" of operations or resources needs every node property, more than the canonical
+# queries project, so those questions stay with the Cypher chain
+
+# Answers computed from the adjacency lists, and the Cypher each one stands for
+CLOSURE_QUERY = ("MATCH (o:Operation)-[:hasPredecessor*]->(p:Operation) {where}"
+                 "RETURN o.name AS operation, p.name AS depends_on")
+SUCCESSOR_QUERY = ("MATCH (s:Operation)-[:hasPredecessor]->(o:Operation) {where}"
+                   "RETURN o.name AS operation, s.name AS successor")
+
+# The canonical rows only answer questions about all operations, processes or resources, or about named
+# operations; any other word (a type, a resource, a filter or an aggregation) leaves the question to the Cypher chain
+INDEX_WORDS = {
+    "a", "all", "an", "and", "are", "between", "by", "do", "does", "each", "every", "for", "give", "have", "in",
+    "is", "its", "list", "me", "of", "per", "please", "show", "tell", "the", "their", "them", "to", "what", "with",
+    "according", "information", "merge", "name", "names", "need", "needed", "needs", "number", "relationship",
+    "relationships", "require", "required", "requires", "search",
+    "operation", "operations", "predecessor", "predecessors", "successor", "successors", "direct", "immediate",
+    "transitive", "indirect", "upstream", "recursive", "process", "processes", "sub", "subprocess", "subprocesses",
+    "resource", "resources"
+}
+QUESTION_WORD = re.compile(r"[a-z]+|\d+|[^\sa-z\d.,;:?!'\"()-]")
+RETURN_CLAUSE = re.compile(r"\bRETURN\s+(.+?)(?:\s+AS\s+\w+)?\s*(?:,|$)", re.IGNORECASE | re.DOTALL)
+
+
+def unexpected_words(normalized):
+    words = QUESTION_WORD.findall(OPERATION_CODE.sub(" ", normalized.replace("'s", "")))
+    return [word for word in words if word not in INDEX_WORDS]
+
+
+class GraphIndex:
+
+    def __init__(self, queries=None, max_age=0):
+        self.queries = queries or load_canonical_queries()
+        # Property edits leave the node and relationship counts unchanged, so the index also expires by age
+        self.max_age = max_age
+        self.version = None
+        self.loaded_at = 0.0
+        self.results = OrderedDict()
+        self.knowledge = KnowledgeStore()
+        self.successors = OrderedDict()
+        self.closures = OrderedDict()
+        self.by_code = {}
+        self.lock = threading.Lock()
+
+    def is_current(self, version):
+        return version == self.version and (not self.max_age or time.time() - self.loaded_at < self.max_age)
+
+    def refresh(self, version, query):
+        # Reloaded whenever the graph data version changes or the snapshot expires, readers keep the previous one meanwhile
+        if self.is_current(version):
+            return False
+        with self.lock:
+            if self.is_current(version):
+                return False
+            results = OrderedDict()
+            knowledge = KnowledgeStore()
+            for name, cypher in self.queries.items():
+                try:
+                    rows = query(cypher)
+                except Exception as e:
+                    print(f"【Warning】Graph index query '{name}' failed: {str(e)}")
+                    continue
+                if not rows:
+                    # Usually labels or properties this graph does not use; its questions go to the Cypher chain
+                    print(f"【Warning】Graph index query '{name}' returned no rows, its questions are not indexed")
+                    continue
+                results[name] = (cypher, rows)
+                knowledge.ingest(rows)
+            self.install(results, knowledge)
+            self.version = version
+            self.loaded_at = time.time()
+        return True
+
+    def install(self, results, knowledge):
+        predecessors = OrderedDict(
+            (name, list(record["predecessors"])) for name, record in knowledge.operations.items()
+        )
+        successors = OrderedDict((name, []) for name in predecessors)
+        for name, preds in predecessors.items():
+            for pred in preds:
+                successors.setdefault(pred, []).append(name)
+        self.results = results
+        self.knowledge = knowledge
+        self.successors = successors
+        self.closures = predecessor_closures(predecessors)
+        self.by_code = {}
+        for name in predecessors:
+            match = OPERATION_CODE.match(name.lower())
+            if match:
+                self.by_code.setdefault(match.group(), name)
+
+    def is_loaded(self):
+        return bool(self.results)
+
+    def match(self, normalized):
+        if unexpected_words(normalized):
+            return None
+        for intent, canonical, pattern in INDEX_INTENTS:
+            if canonical in self.results and pattern.search(normalized):
+                return intent, canonical
+        return None
+
+    def answer(self, normalized):
+        # Returns (intent, cypher, rows) for a recognized question, or None
+        matched = self.match(normalized)
+        if matched is None:
+            return None
+        intent, canonical = matched
+        cypher, rows = self.results[canonical]
+        targets = [self.by_code[code] for code in OPERATION_CODE.findall(normalized) if code in self.by_code]
+        if OPERATION_CODE.search(normalized) and not targets:
+            # An operation the graph does not know, let the Cypher chain report it
+            return None
+
+        if intent == "predecessor_closure":
+            names = targets or list(self.closures)
+            rows = [{"operation": name, "depends_on": pred, "distance": distance}
+                    for name in names for pred, distance in self.closures.get(name, {}).items()]
+            return intent, derived_query(CLOSURE_QUERY, targets), rows
+        if intent == "successors":
+            names = targets or list(self.successors)
+            rows = [{"operation": name, "successor": succ} for name in names for succ in self.successors.get(name, [])]
+            return intent, derived_query(SUCCESSOR_QUERY, targets), rows
+        if targets:
+            if intent == "processes":
+                # Process rows are keyed on the process, not on the operation
+                return None
+            rows = [row for row in rows if first_value(row) in targets]
+            cypher = filtered_query(cypher, targets)
+        return intent, cypher, rows
+
+
+def predecessor_closures(predecessors):
+    # Every upstream operation of each operation with its distance in hasPredecessor steps
+    try:
+        order = list(TopologicalSorter(predecessors).static_order())
+    except CycleError as e:
+        print(f"【Warning】Predecessor cycle in the graph, transitive predecessors are not indexed: {e.args[1]}")
+        return OrderedDict()
+
+    closures = {}
+    for name in order:
+        closure = OrderedDict()
+        for pred in predecessors.get(name, []):
+            closure[pred] = 1
+        for pred in predecessors.get(name, []):
+            for ancestor, distance in closures[pred].items():
+                if closure.get(ancestor, distance + 2) > distance + 1:
+                    closure[ancestor] = distance + 1
+        closures[name] = closure
+    return OrderedDict((name, closures[name]) for name in predecessors)
+
+
+def derived_query(template, names):
+    # The equivalent Cypher, shown to the answer model and used as the cache key of the answer
+    where = f"WHERE o.name IN [{', '.join(repr(name) for name in names)}] " if names else ""
+    return template.format(where=where)
+
+
+def filtered_query(cypher, names):
+    # The canonical Cypher restricted to the named operations on its first returned column
+    returned = None
+    for returned in RETURN_CLAUSE.finditer(cypher):
+        pass
+    if returned is None:
+        return cypher
+    where = f"WITH * WHERE {returned.group(1).strip()} IN [{', '.join(repr(name) for name in names)}] "
+    return cypher[:returned.start()] + where + cypher[returned.start():]
+
+
+def first_value(row):
+    return next(iter(row.values()), None) if isinstance(row, dict) else row
@@ -0,0 +1,191 @@
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from format_for_Design_on_Graph import flatten_row
+
+OPERATION_CODE = re.compile(r"^[A-Za-z]+\d+_\d+")
+
+# Fixed queries that pull the whole planning problem, aliased so KnowledgeStore can read them;
+# a JSON file of {name: cypher} in CANONICAL_QUERIES_PATH overrides them for other ontologies
+CANONICAL_QUERIES_PATH = os.getenv("CANONICAL_QUERIES_PATH")
+CANONICAL_QUERIES = OrderedDict([
+    ("operations", "MATCH (o:Operation) "
+                   "RETURN o.name AS operation, o.type AS operation_type, o.duration AS operation_duration"),
+    ("predecessors", "MATCH (o:Operation)-[:hasPredecessor]->(p:Operation) "
+                     "RETURN o.name AS operation, p.name AS predecessor"),
+    ("requirements", "MATCH (o:Operation)-[r:requiresResource]->(res:Resource) "
+                     "RETURN o.name AS operation, res.name AS resource, r.number AS resource_number"),
+    ("resources", "MATCH (res:Resource) RETURN res.name AS resource, res.cost AS resource_cost, "
+                  "res.calendar AS resource_calendar, res.quantity AS resource_quantity"),
+    ("processes", "MATCH (p:Process)-[:hasSubprocess]->(s) RETURN p.name AS process, s.name AS subprocess")
+])
+
+ROLE_WORDS = OrderedDict([
+    ("predecessor", {"predecessor", "predecessors", "pred", "preceding", "previous", "prerequisite"}),
+    ("subprocess", {"subprocess", "subprocesses"}),
+    ("process", {"process", "processes"}),
+    ("resource", {"resource", "resources", "res"}),
+    ("operation", {"operation", "operations", "op", "ops", "task"})
+])
+
+ATTRIBUTE_WORDS = OrderedDict([
+    ("duration", {"duration", "time", "minutes", "min"}),
+    ("type", {"type", "kind", "mode"}),
+    ("cost", {"cost", "price", "rate"}),
+    ("calendar", {"calendar", "shift"}),
+    ("quantity", {"quantity", "qty", "capacity", "available"}),
+    ("number", {"number", "num", "need", "needed", "required", "amount", "count"}),
+    ("name", {"name", "label", "id"})
+])
+
+
+def tokenize_column(column):
+    words = re.sub(r"([a-z])([A-Z])", r"\1 \2", str(column))
+    return [w.lower() for w in re.split(r"[^A-Za-z0-9]+", words) if w]
+
+
+def classify_column(column):
+    tokens = tokenize_column(column)
+    role = next((r for r, words in ROLE_WORDS.items() if any(t in words for t in tokens)), None)
+    attribute = next((a for a, words in ATTRIBUTE_WORDS.items() if any(t in words for t in tokens)), None)
+    return role, attribute
+
+
+def as_names(value):
+    values = value if isinstance(value, (list, tuple, set)) else [value]
+    return [str(v) for v in values if v not in (None, "")]
+
+
+def format_value(value):
+    return "" if value is None else str(value)
+
+
+class KnowledgeStore:
+
+    def __init__(self):
+        self.operations = OrderedDict()
+        self.resources = OrderedDict()
+        self.processes = OrderedDict()
+        self.lock = threading.Lock()
+
+    def operation(self, name):
+        return self.operations.setdefault(name, {
+            "type": None, "duration": None, "resources": OrderedDict(), "predecessors": OrderedDict()
+        })
+
+    def resource(self, name):
+        return self.resources.setdefault(name, {"cost": None, "calendar": None, "quantity": None})
+
+    def ingest(self, graph_data):
+        if not isinstance(graph_data, list):
+            return
+        with self.lock:
+            for row in graph_data:
+                if isinstance(row, dict):
+                    self.ingest_row(flatten_row(row))
+
+    def ingest_row(self, row):
+        entities = {}
+        loose = {}
+        for column, value in row.items():
+            role, attribute = classify_column(column)
+            if attribute is None and isinstance(value, (str, list)):
+                attribute = "name"
+            if attribute is None:
+                continue
+            if role is None:
+                loose.setdefault(attribute, value)
+            else:
+                entities.setdefault(role, {}).setdefault(attribute, value)
+
+        # Attributes without a role word belong to whichever entity they describe
+        operation = entities.get("operation", {})
+        resource = entities.get("resource", {})
+        loose_name = loose.get("name")
+        if "name" not in operation and loose_name is not None and all(
+                OPERATION_CODE.match(n) for n in as_names(loose_name)):
+            operation["name"] = loose_name
+        elif "name" not in resource and loose_name is not None and not operation:
+            resource["name"] = loose_name
+        for attribute in ("duration", "type"):
+            if attribute in loose:
+                operation.setdefault(attribute, loose[attribute])
+        for attribute in ("cost", "calendar", "quantity"):
+            if attribute in loose:
+                resource.setdefault(attribute, loose[attribute])
+        required_number = resource.get("number", loose.get("number"))
+
+        operation_names = as_names(operation.get("name"))
+        for name in operation_names:
+            record = self.operation(name)
+            for attribute in ("type", "duration"):
+                if operation.get(attribute) is not None:
+                    record[attribute] = operation[attribute]
+            for predecessor in as_names(entities.get("predecessor", {}).get("name")):
+                record["predecessors"][predecessor] = True
+            for resource_name in as_names(resource.get("name")):
+                record["resources"][resource_name] = required_number
+
+        for resource_name in as_names(resource.get("name")):
+            record = self.resource(resource_name)
+            for attribute in ("cost", "calendar", "quantity"):
+                if resource.get(attribute) is not None:
+                    record[attribute] = resource[attribute]
+
+        for process_name in as_names(entities.get("process", {}).get("name")):
+            subprocesses = self.processes.setdefault(process_name, OrderedDict())
+            for subprocess in as_names(entities.get("subprocess", {}).get("name")):
+                subprocesses[subprocess] = True
+
+    def is_empty(self):
+        return not (self.operations or self.resources or self.processes)
+
+    def render(self):
+        with self.lock:
+            lines = []
+            if self.operations:
+                lines.append(f"Operations ({len(self.operations)}):")
+                lines.append("| Operation | Type | Duration (min) | Required Resources | Immediate Predecessors |")
+                lines.append("|-----------|------|----------------|--------------------|------------------------|")
+                for name, record in self.operations.items():
+                    resources = ", ".join(
+                        f"{r} ({format_value(n)})" if n is not None else r for r, n in record["resources"].items()
+                    )
+                    predecessors = ", ".join(record["predecessors"])
+                    lines.append(f"| {name} | {format_value(record['type'])} | {format_value(record['duration'])} "
+                                 f"| {resources} | {predecessors} |")
+            if self.resources:
+                lines.append(f"Resources ({len(self.resources)}):")
+                lines.append("| Resource | Cost (€/h) | Calendar | Quantity |")
+                lines.append("|----------|------------|----------|----------|")
+                for name, record in self.resources.items():
+                    lines.append(f"| {name} | {format_value(record['cost'])} | {format_value(record['calendar'])} "
+                                 f"| {format_value(record['quantity'])} |")
+            if self.processes:
+                lines.append(f"Processes ({len(self.processes)}):")
+                lines.append("| Process | Subprocesses |")
+                lines.append("|---------|--------------|")
+                for name, subprocesses in self.processes.items():
+                    lines.append(f"| {name} | {', '.join(subprocesses)} |")
+            return "\n".join(lines)
+
+
+def load_canonical_queries(path=CANONICAL_QUERIES_PATH):
+    queries = OrderedDict(CANONICAL_QUERIES)
+    if path and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            queries.update(json.load(f))
+    return queries
+
+
+def load_knowledge(query, queries=None):
+    store = KnowledgeStore()
+    for name, cypher in (queries or load_canonical_queries()).items():
+        try:
+            store.ingest(query(cypher))
+        except Exception as e:
+            print(f"【Warning】Canonical query '{name}' failed: {str(e)}")
+    return store
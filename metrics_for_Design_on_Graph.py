@@ -0,0 +1,238 @@
+import asyncio
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from langchain_core.callbacks import UsageMetadataCallbackHandler
+
+METRICS_TRACE_PATH = os.getenv("METRICS_TRACE_PATH")
+METRICS_PREFIX = "design_on_graph"
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+current_trace = contextvars.ContextVar("current_trace", default=None)
+current_span = contextvars.ContextVar("current_span", default=None)
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f"{name}=\"{escape_label(value)}\"" for name, value in labels) + "}"
+
+
+class Metrics:
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self.counters = OrderedDict()
+        self.histograms = OrderedDict()
+        self.help = {}
+        self.lock = threading.Lock()
+
+    def increment(self, name, help_text, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.help[name] = help_text
+            series = self.counters.setdefault(name, OrderedDict())
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name, help_text, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.help[name] = help_text
+            series = self.histograms.setdefault(name, OrderedDict())
+            counts, total, count = series.get(key, ([0] * len(self.buckets), 0.0, 0))
+            counts = [bucket + (value <= bound) for bucket, bound in zip(counts, self.buckets)]
+            series[key] = (counts, total + value, count + 1)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, series in self.counters.items():
+                metric = f"{METRICS_PREFIX}_{name}"
+                lines.append(f"# HELP {metric} {self.help[name]}")
+                lines.append(f"# TYPE {metric} counter")
+                for key, value in series.items():
+                    lines.append(f"{metric}{format_labels(key)} {value}")
+            for name, series in self.histograms.items():
+                metric = f"{METRICS_PREFIX}_{name}"
+                lines.append(f"# HELP {metric} {self.help[name]}")
+                lines.append(f"# TYPE {metric} histogram")
+                for key, (counts, total, count) in series.items():
+                    for bound, bucket in zip(self.buckets, counts):
+                        lines.append(f"{metric}_bucket{format_labels(key + (('le', bound),))} {bucket}")
+                    lines.append(f"{metric}_bucket{format_labels(key + (('le', '+Inf'),))} {count}")
+                    lines.append(f"{metric}_sum{format_labels(key)} {total}")
+                    lines.append(f"{metric}_count{format_labels(key)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+metrics = Metrics()
+trace_file_lock = threading.Lock()
+
+
+def record_cache(stage, hit):
+    metrics.increment("cache_requests_total", "Cache lookups per stage", stage=stage,
+                      result="hit" if hit else "miss")
+
+
+class Trace:
+
+    def __init__(self, question, session_id=None):
+        self.trace_id = uuid.uuid4().hex
+        self.question = question
+        self.session_id = session_id
+        self.started_at = time.time()
+        self.start_time = time.perf_counter()
+        self.attributes = {}
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def add_span(self, record):
+        with self.lock:
+            self.spans.append(record)
+
+    def finish(self, route=None, status="ok"):
+        duration = time.perf_counter() - self.start_time
+        metrics.increment("requests_total", "Questions answered by route and status",
+                          route=route or "unknown", status=status)
+        metrics.observe("request_duration_seconds", "End-to-end duration of a question", duration,
+                        route=route or "unknown")
+        if current_trace.get() is self:
+            current_trace.set(None)
+        if not METRICS_TRACE_PATH:
+            return
+
+        entry = {
+            "trace_id": self.trace_id,
+            "session_id": self.session_id,
+            "question": self.question,
+            "route": route,
+            "status": status,
+            "started_at": self.started_at,
+            "duration": round(duration, 6),
+            "attributes": self.attributes,
+            "spans": self.spans
+        }
+        directory = os.path.dirname(METRICS_TRACE_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with trace_file_lock, open(METRICS_TRACE_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+
+
+def start_trace(question, session_id=None):
+    trace = Trace(question, session_id)
+    current_trace.set(trace)
+    return trace
+
+
+def traced_stream(generator):
+    # Gradio may resume a streaming handler on another worker, so every step runs in one pinned context
+    context = contextvars.copy_context()
+    try:
+        while True:
+            try:
+                yield context.run(next, generator)
+            except StopIteration:
+                return
+    finally:
+        context.run(generator.close)
+
+
+async def atraced_stream(generator):
+    context = contextvars.copy_context()
+    try:
+        while True:
+            try:
+                yield await asyncio.create_task(generator.__anext__(), context=context)
+            except StopAsyncIteration:
+                return
+    finally:
+        await asyncio.create_task(generator.aclose(), context=context)
+
+
+def annotate(**attributes):
+    # Attributes land on the innermost open span, or on the trace between spans
+    record = current_span.get()
+    if record is None:
+        trace = current_trace.get()
+        record = trace.attributes if trace is not None else None
+    if record is not None:
+        record.update(attributes)
+
+
+def llm_config():
+    # Callbacks collecting the token usage of LLM calls made inside the current span
+    record = current_span.get()
+    if record is None:
+        return {}
+    handler = UsageMetadataCallbackHandler()
+    record.setdefault("usage_handlers", []).append(handler)
+    return {"callbacks": [handler]}
+
+
+def collect_usage(record):
+    prompt_tokens = completion_tokens = 0
+    for handler in record.pop("usage_handlers", []):
+        for usage in handler.usage_metadata.values():
+            prompt_tokens += usage.get("input_tokens", 0)
+            completion_tokens += usage.get("output_tokens", 0)
+    if prompt_tokens or completion_tokens:
+        record["prompt_tokens"] = prompt_tokens
+        record["completion_tokens"] = completion_tokens
+
+
+@contextmanager
+def span(stage, **attributes):
+    record = dict(attributes, stage=stage)
+    trace = current_trace.get()
+    parent = current_span.get()
+    current_span.set(record)
+    start_time = time.perf_counter()
+    status = "ok"
+    try:
+        yield record
+    except (GeneratorExit, asyncio.CancelledError):
+        status = "cancelled"
+        raise
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        current_span.set(parent)
+        duration = time.perf_counter() - start_time
+        record["duration"] = round(duration, 6)
+        record["status"] = status
+        collect_usage(record)
+        finish_span(record, duration)
+        if trace is not None:
+            trace.add_span(record)
+
+
+def finish_span(record, duration):
+    stage = record["stage"]
+    metrics.observe("stage_duration_seconds", "Duration of each pipeline stage", duration, stage=stage)
+    if record["status"] == "error":
+        metrics.increment("stage_errors_total", "Pipeline stages that raised", stage=stage)
+    if "cache_hit" in record:
+        record_cache(stage, record["cache_hit"])
+    if isinstance(record.get("rows"), int):
+        metrics.increment("result_rows_total", "Rows produced per stage", record["rows"], stage=stage)
+    for kind in ("prompt", "completion"):
+        if record.get(f"{kind}_tokens"):
+            metrics.increment("llm_tokens_total", "LLM tokens per stage", record[f"{kind}_tokens"],
+                              stage=stage, kind=kind)
@@ -0,0 +1,105 @@
+import os
+import re
+
+from metrics_for_Design_on_Graph import annotate
+
+CYPHER_TIMEOUT = float(os.getenv("CYPHER_TIMEOUT", "10"))
+CYPHER_FETCH_SIZE = int(os.getenv("CYPHER_FETCH_SIZE", "100"))
+CYPHER_MAX_ESTIMATED_ROWS = float(os.getenv("CYPHER_MAX_ESTIMATED_ROWS", "1000000"))
+CYPHER_MAX_CARTESIAN_ROWS = float(os.getenv("CYPHER_MAX_CARTESIAN_ROWS", "10000"))
+NEO4J_POOL_SIZE = int(os.getenv("NEO4J_POOL_SIZE", "16"))
+
+TRAILING_LIMIT = re.compile(r"\bLIMIT\s+(\d+|\$\w+)\s*$", re.IGNORECASE)
+UNION = re.compile(r"\bUNION\b", re.IGNORECASE)
+
+
+class QueryRejected(Exception):
+    pass
+
+
+def plan_operators(plan):
+    # Flattens an EXPLAIN plan into (operator, estimated rows) pairs
+    stack = [plan] if plan else []
+    while stack:
+        node = stack.pop()
+        operator = str(node.get("operatorType", "")).split("@")[0]
+        yield operator, float(node.get("args", {}).get("EstimatedRows", 0) or 0)
+        stack.extend(node.get("children", []))
+
+
+def with_limit(cypher, limit):
+    # The server stops producing rows at the limit, the client stops reading there anyway
+    cypher = cypher.strip().rstrip(";").strip()
+    if not limit or TRAILING_LIMIT.search(cypher) or UNION.search(cypher):
+        return cypher
+    return f"{cypher}\nLIMIT {int(limit)}"
+
+
+class CypherExecutor:
+
+    def __init__(self, driver=None, database=None, query=None, timeout=CYPHER_TIMEOUT, fetch_size=CYPHER_FETCH_SIZE,
+                 max_estimated_rows=CYPHER_MAX_ESTIMATED_ROWS, max_cartesian_rows=CYPHER_MAX_CARTESIAN_ROWS):
+        self.driver = driver
+        self.database = database
+        # Graph stores without a driver are queried directly, with the row limit applied afterwards
+        self.fallback_query = query
+        self.timeout = timeout
+        self.fetch_size = fetch_size
+        self.max_estimated_rows = max_estimated_rows
+        self.max_cartesian_rows = max_cartesian_rows
+
+    def session(self):
+        from neo4j import READ_ACCESS
+        return self.driver.session(database=self.database, default_access_mode=READ_ACCESS,
+                                   fetch_size=self.fetch_size)
+
+    def explain(self, cypher, params=None):
+        from neo4j import Query
+
+        def work(tx):
+            return tx.run(Query("EXPLAIN " + cypher, timeout=self.timeout), params or {}).consume().plan
+
+        with self.session() as session:
+            return session.execute_read(work)
+
+    def check_plan(self, cypher, params=None):
+        estimated_rows = 0.0
+        for operator, rows in plan_operators(self.explain(cypher, params)):
+            estimated_rows = max(estimated_rows, rows)
+            if operator == "CartesianProduct" and rows > self.max_cartesian_rows:
+                raise QueryRejected(f"Query plan builds a cartesian product of ~{int(rows)} rows")
+            if rows > self.max_estimated_rows:
+                raise QueryRejected(f"Query plan estimates ~{int(rows)} rows at {operator}, "
+                                    f"over the limit of {int(self.max_estimated_rows)}")
+        annotate(estimated_rows=int(estimated_rows))
+        return estimated_rows
+
+    def query(self, cypher, params=None, limit=None):
+        if self.driver is None:
+            rows = self.fallback_query(cypher)
+            return rows[:limit] if limit else rows
+
+        from neo4j import Query
+        # The plan is checked with the LIMIT in place, so only eager or exploding operators stay over the limits
+        bounded = with_limit(cypher, limit)
+        self.check_plan(bounded, params)
+
+        def work(tx):
+            rows = []
+            # Records arrive in batches of fetch_size, the rest is discarded once the limit is reached
+            for record in tx.run(Query(bounded, timeout=self.timeout), params or {}):
+                rows.append(record.data())
+                if limit and len(rows) >= limit:
+                    break
+            return rows
+
+        with self.session() as session:
+            return session.execute_read(work)
+
+
+def executor_for_graph(graph):
+    # Neo4jGraph keeps its pooled driver private; reuse it rather than opening a second pool
+    driver = getattr(graph, "_driver", None)
+    if driver is None:
+        return CypherExecutor(query=graph.query)
+    return CypherExecutor(driver, database=getattr(graph, "_database", None))
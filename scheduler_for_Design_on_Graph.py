@@ -0,0 +1,301 @@
+import re
+from collections import OrderedDict
+
+OPERATION_CODE = re.compile(r"^([A-Za-z]+\d+_\d+)")
+
+# The fuselage joint constraints of the "Plan" example, expressed by operation code
+PLAN_RULES = {
+    "bodies": 4,
+    "start_operations": ["S40_00001", "S40_01001"],
+    "end_operations": ["S40_00002"],
+    "auto_completion": "S40_04012",
+    "manual_completion": "S40_04013",
+    "auto_setup": ["S40_02001"],
+    "auto_teardown": ["S40_04014"],
+    "finish_operations": ["S40_02002", "S40_02003"],
+    "min_automatic_bodies": 1,
+    "min_manual_bodies": 1,
+    "max_parallel_manual": 2,
+    "objective": "makespan"
+}
+
+
+class SchedulingError(Exception):
+    pass
+
+
+def operation_code(name):
+    match = OPERATION_CODE.match(str(name))
+    return match.group(1) if match else str(name)
+
+
+def to_number(value, default=None):
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = re.search(r"-?\d+(\.\d+)?", str(value)) if value is not None else None
+    return float(match.group()) if match else default
+
+
+def normalize_type(value):
+    text = str(value or "").lower()
+    if "auto" in text:
+        return "Automatic"
+    if "manual" in text:
+        return "Manual"
+    return None
+
+
+def problem_from_knowledge(knowledge):
+    with knowledge.lock:
+        operations = OrderedDict()
+        for name, record in knowledge.operations.items():
+            operations[name] = {
+                "type": normalize_type(record["type"]),
+                "duration": to_number(record["duration"]),
+                "resources": OrderedDict((r, to_number(n, 1.0)) for r, n in record["resources"].items()),
+                "predecessors": list(record["predecessors"])
+            }
+        resources = OrderedDict()
+        for name, record in knowledge.resources.items():
+            resources[name] = {
+                "cost": to_number(record["cost"], 0.0),
+                "calendar": record["calendar"],
+                "quantity": to_number(record["quantity"])
+            }
+    return {"operations": operations, "resources": resources}
+
+
+def format_number(value):
+    return str(int(value)) if float(value).is_integer() else f"{value:.2f}"
+
+
+class AssemblyScheduler:
+
+    def __init__(self, problem, rules=None):
+        self.rules = dict(PLAN_RULES, **(rules or {}))
+        self.operations = problem["operations"]
+        self.resources = problem["resources"]
+        self.by_code = {}
+        for name in self.operations:
+            self.by_code.setdefault(operation_code(name), name)
+
+    def resolve(self, name_or_code):
+        if name_or_code in self.operations:
+            return name_or_code
+        return self.by_code.get(operation_code(name_or_code))
+
+    def resolve_all(self, codes):
+        names = []
+        for code in codes:
+            name = self.resolve(code)
+            if name is None:
+                raise SchedulingError(f"Operation {code} is missing from the graph data")
+            names.append(name)
+        return names
+
+    def predecessors(self, name):
+        resolved = (self.resolve(p) for p in self.operations[name]["predecessors"])
+        return [p for p in resolved if p is not None]
+
+    def body_chain(self, completion_code, shared):
+        completion = self.resolve(completion_code)
+        if completion is None:
+            return None
+
+        members, stack = set(), [completion]
+        while stack:
+            name = stack.pop()
+            if name in members or name in shared:
+                continue
+            members.add(name)
+            stack.extend(self.predecessors(name))
+
+        # Kahn's algorithm restricted to the chain, ties broken by operation code
+        in_chain = {name: [p for p in self.predecessors(name) if p in members] for name in members}
+        remaining = {name: len(preds) for name, preds in in_chain.items()}
+        successors = {name: [] for name in members}
+        for name, preds in in_chain.items():
+            for pred in preds:
+                successors[pred].append(name)
+        ready = sorted((n for n, count in remaining.items() if count == 0), key=operation_code)
+        order = []
+        while ready:
+            name = ready.pop(0)
+            order.append(name)
+            for succ in successors[name]:
+                remaining[succ] -= 1
+                if remaining[succ] == 0:
+                    ready.append(succ)
+                    ready.sort(key=operation_code)
+        if len(order) != len(members):
+            raise SchedulingError(f"Predecessor cycle among the operations leading to {completion}")
+        return order
+
+    def check_external_predecessors(self, chain, placed_before):
+        for name in chain:
+            for pred in self.predecessors(name):
+                if pred not in chain and pred not in placed_before:
+                    return f"{name} requires {pred}, which the rules place after it"
+        return None
+
+    def parallel_capacity(self, chain):
+        limit = int(self.rules["max_parallel_manual"])
+        for name in chain:
+            for resource, number in self.operations[name]["resources"].items():
+                quantity = self.resources.get(resource, {}).get("quantity")
+                if quantity is not None and number:
+                    limit = min(limit, int(quantity // number))
+        return max(limit, 1)
+
+    def duration(self, name):
+        value = self.operations[name]["duration"]
+        if value is None:
+            raise SchedulingError(f"No duration known for {name}")
+        return value
+
+    def hourly_cost(self, name):
+        return sum(
+            (self.resources.get(resource, {}).get("cost") or 0.0) * (number or 1.0)
+            for resource, number in self.operations[name]["resources"].items()
+        )
+
+    def build_steps(self, chains, shared, n_auto, manual_groups, manual_first):
+        steps = []
+        auto_block = []
+        if n_auto:
+            auto_block += [[name] for name in shared["auto_setup"]]
+            for _ in range(n_auto):
+                auto_block += [[name] for name in chains["auto"]]
+            auto_block += [[name] for name in shared["auto_teardown"] + shared["finish"]]
+
+        manual_block = []
+        for group_size in manual_groups:
+            for name in chains["manual"]:
+                # Only identical manual operations may run side by side, automatic ones stay serial
+                if group_size > 1 and self.operations[name]["type"] != "Automatic":
+                    manual_block.append([name] * group_size)
+                else:
+                    manual_block += [[name] for _ in range(group_size)]
+
+        steps += [[name] for name in shared["start"]]
+        if manual_first:
+            steps += manual_block
+            steps += auto_block if n_auto else [[name] for name in shared["finish"]]
+        else:
+            steps += auto_block + manual_block
+            if manual_groups:
+                steps += [[name] for name in shared["finish"]]
+        steps += [[name] for name in shared["end"]]
+        return steps
+
+    def evaluate(self, steps):
+        makespan = sum(self.duration(step[0]) for step in steps)
+        cost = sum(self.duration(name) / 60 * self.hourly_cost(name) for step in steps for name in step)
+        return makespan, cost
+
+    def candidates(self):
+        rules = self.rules
+        shared = {
+            "start": self.resolve_all(rules["start_operations"]),
+            "end": self.resolve_all(rules["end_operations"]),
+            "auto_setup": [n for n in map(self.resolve, rules["auto_setup"]) if n],
+            "auto_teardown": [n for n in map(self.resolve, rules["auto_teardown"]) if n],
+            "finish": self.resolve_all(rules["finish_operations"])
+        }
+        shared_names = {name for names in shared.values() for name in names}
+        chains = {
+            "auto": self.body_chain(rules["auto_completion"], shared_names),
+            "manual": self.body_chain(rules["manual_completion"], shared_names)
+        }
+        if not chains["auto"] and not chains["manual"]:
+            raise SchedulingError("Neither the automatic nor the manual completion operation is in the graph data")
+
+        bodies = int(rules["bodies"])
+        capacity = self.parallel_capacity(chains["manual"]) if chains["manual"] else 1
+        problems = []
+        for n_auto in range(bodies + 1):
+            n_manual = bodies - n_auto
+            if (n_auto and not chains["auto"]) or (n_manual and not chains["manual"]):
+                continue
+            if n_auto < rules["min_automatic_bodies"] or n_manual < rules["min_manual_bodies"]:
+                continue
+            manual_groups = [min(capacity, n_manual - i) for i in range(0, n_manual, capacity)]
+            # Manual bodies first share one cleanup and inspection with the automatic ones
+            for manual_first in ((True, False) if n_auto and n_manual else (True,)):
+                auto_before = set(shared["start"] + shared["auto_setup"])
+                manual_before = set(shared["start"])
+                if manual_first:
+                    auto_before |= set(chains["manual"] or [])
+                else:
+                    manual_before |= set(shared["auto_setup"] + shared["auto_teardown"] + shared["finish"])
+                    manual_before |= set(chains["auto"])
+                problem = None
+                if n_auto:
+                    problem = self.check_external_predecessors(chains["auto"], auto_before)
+                if n_manual and problem is None:
+                    problem = self.check_external_predecessors(chains["manual"], manual_before)
+                if problem:
+                    problems.append(problem)
+                    continue
+                steps = self.build_steps(chains, shared, n_auto, manual_groups, manual_first)
+                yield n_auto, n_manual, steps
+        self.rejections = problems
+
+    def schedule(self):
+        self.rejections = []
+        best = None
+        for n_auto, n_manual, steps in self.candidates():
+            makespan, cost = self.evaluate(steps)
+            key = (makespan, cost) if self.rules["objective"] == "makespan" else (cost, makespan)
+            if best is None or key < best[0]:
+                best = (key, n_auto, n_manual, steps, makespan, cost)
+        if best is None:
+            reasons = "; ".join(OrderedDict.fromkeys(self.rejections)) or "no combination satisfies the rules"
+            raise SchedulingError(f"No feasible assembly scheme: {reasons}")
+
+        _, n_auto, n_manual, steps, makespan, cost = best
+        rows, clock = [], 0.0
+        for order, step in enumerate(steps, start=1):
+            duration = self.duration(step[0])
+            for lane, name in enumerate(step):
+                rows.append({
+                    "order": f"{order}{chr(ord('a') + lane)}" if len(step) > 1 else str(order),
+                    "operation": name,
+                    "type": self.operations[name]["type"] or "",
+                    "resources": self.operations[name]["resources"],
+                    "duration": duration,
+                    "start": clock,
+                    "end": clock + duration,
+                    "group": chr(ord('a') + lane) if len(step) > 1 else "-"
+                })
+            clock += duration
+        return {
+            "rows": rows,
+            "automatic_bodies": n_auto,
+            "manual_bodies": n_manual,
+            "makespan": makespan,
+            "cost": cost
+        }
+
+
+def schedule_assembly(problem, rules=None):
+    return AssemblyScheduler(problem, rules).schedule()
+
+
+def render_schedule(schedule):
+    lines = [
+        "| Order | Operation | Type | Required Resources | Duration | Start Time | End Time | Parallel Group |",
+        "|-------|-----------|------|--------------------|----------|------------|----------|----------------|"
+    ]
+    for row in schedule["rows"]:
+        required = ", ".join(f"{r} ({format_number(n or 1)})" for r, n in row["resources"].items())
+        lines.append(
+            f"| {row['order']} | {row['operation']} | {row['type']} | {required} | {format_number(row['duration'])} "
+            f"| {format_number(row['start'])} | {format_number(row['end'])} | {row['group']} |"
+        )
+    lines.append("")
+    lines.append(f"Automatic 1/4 bodies: {schedule['automatic_bodies']}, "
+                 f"manual 1/4 bodies: {schedule['manual_bodies']}")
+    lines.append(f"Total time: {format_number(schedule['makespan'])} min")
+    lines.append(f"Total cost: {format_number(schedule['cost'])} €")
+    return "\n".join(lines)
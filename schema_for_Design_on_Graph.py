@@ -0,0 +1,141 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from format_for_Design_on_Graph import count_tokens
+
+# Optional local embedding model (sentence-transformers) used next to the lexical match, e.g. all-MiniLM-L6-v2
+SCHEMA_EMBEDDING_MODEL = os.getenv("SCHEMA_EMBEDDING_MODEL")
+SCHEMA_EMBEDDING_THRESHOLD = float(os.getenv("SCHEMA_EMBEDDING_THRESHOLD", "0.45"))
+SELECTION_CACHE_SIZE = 256
+
+STOP_WORDS = {
+    "a", "an", "and", "all", "are", "as", "by", "each", "every", "for", "from", "has", "have", "in", "is", "it", "list",
+    "of", "on", "or", "please", "show", "the", "their", "them", "to", "what", "which", "with", "information",
+    # Properties nearly every label has would match every question
+    "name", "id"
+}
+
+embedders = {}
+embedders_lock = threading.Lock()
+
+
+def stem(word):
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 4 and word.endswith(("sses", "xes", "ches", "shes")):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def identifier_tokens(name):
+    # "hasSubprocess" -> {"has", "subprocess"}, "resource_cost" -> {"resource", "cost"}
+    words = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", str(name))
+    return {stem(w.lower()) for w in re.split(r"[^A-Za-z0-9]+", words) if w} - STOP_WORDS
+
+
+def question_tokens(question):
+    return {stem(w) for w in re.findall(r"[a-z0-9]+", str(question).lower())} - STOP_WORDS
+
+
+def load_embedder(model_name):
+    if not model_name:
+        return None
+    with embedders_lock:
+        if model_name not in embedders:
+            try:
+                from sentence_transformers import SentenceTransformer
+                embedders[model_name] = SentenceTransformer(model_name)
+            except Exception as e:
+                print(f"【Warning】Schema embeddings disabled, cannot load {model_name}: {str(e)}")
+                embedders[model_name] = None
+        return embedders[model_name]
+
+
+class SchemaSelector:
+
+    def __init__(self, structured_schema, exclude_types=(), embedding_model=SCHEMA_EMBEDDING_MODEL):
+        excluded = set(exclude_types)
+        self.structured_schema = structured_schema
+        self.node_props = OrderedDict(
+            (label, props) for label, props in structured_schema.get("node_props", {}).items() if label not in excluded
+        )
+        rel_props = structured_schema.get("rel_props", {})
+        self.relationships = [
+            r for r in structured_schema.get("relationships", [])
+            if all(r[key] not in excluded for key in ("start", "type", "end"))
+        ]
+
+        # Every label and relationship type with the tokens of its name and of its properties
+        self.types = OrderedDict()
+        for label, props in self.node_props.items():
+            self.add_type(label, props)
+        for relationship in self.relationships:
+            for label in (relationship["start"], relationship["end"]):
+                self.add_type(label, [])
+            self.add_type(relationship["type"], rel_props.get(relationship["type"], []))
+
+        self.embedder = load_embedder(embedding_model)
+        self.type_vectors = None
+        if self.embedder is not None and self.types:
+            descriptions = [f"{name}: {', '.join(sorted(entry['property_tokens']))}" for name, entry in self.types.items()]
+            self.type_vectors = self.embedder.encode(descriptions, normalize_embeddings=True)
+
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def add_type(self, name, props):
+        entry = self.types.setdefault(name, {"name_tokens": identifier_tokens(name), "property_tokens": set()})
+        for prop in props:
+            entry["property_tokens"] |= identifier_tokens(prop["property"])
+
+    def match(self, question):
+        tokens = question_tokens(question)
+        matched = [name for name, entry in self.types.items()
+                   if tokens & entry["name_tokens"] or tokens & entry["property_tokens"]]
+        if self.type_vectors is not None:
+            scores = self.type_vectors @ self.embedder.encode([question], normalize_embeddings=True)[0]
+            matched += [name for name, score in zip(self.types, scores)
+                        if score >= SCHEMA_EMBEDDING_THRESHOLD and name not in matched]
+        return matched
+
+    def expand(self, matched):
+        # Matched labels bring their relationships and neighbours, matched relationships bring their endpoints
+        selected = set(matched)
+        for relationship in self.relationships:
+            if relationship["type"] in matched or relationship["start"] in matched or relationship["end"] in matched:
+                selected.update((relationship["start"], relationship["type"], relationship["end"]))
+        return [name for name in self.types if name in selected]
+
+    def select(self, question):
+        # The label and relationship types relevant to the question, or None for the full schema
+        key = " ".join(str(question).lower().split())
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+
+        matched = self.match(question)
+        include_types = self.expand(matched) if matched else None
+        if include_types is not None and len(include_types) == len(self.types):
+            include_types = None
+
+        with self.lock:
+            self.cache[key] = include_types
+            while len(self.cache) > SELECTION_CACHE_SIZE:
+                self.cache.popitem(last=False)
+        return include_types
+
+
+def schema_reduction(full_schema, schema):
+    full_tokens = count_tokens(full_schema)
+    tokens = count_tokens(schema)
+    return {
+        "full_tokens": full_tokens,
+        "tokens": tokens,
+        "saved_tokens": full_tokens - tokens,
+        "ratio": round(tokens / full_tokens, 3) if full_tokens else 1.0
+    }
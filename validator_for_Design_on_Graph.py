@@ -0,0 +1,357 @@
+import re
+from bisect import bisect_right
+from collections import Counter, OrderedDict
+
+from scheduler_for_Design_on_Graph import PLAN_RULES, AssemblyScheduler, format_number, normalize_type, to_number
+
+SCHEDULE_COLUMNS = ["order", "operation", "type", "required resources", "duration", "start time", "end time",
+                    "parallel group"]
+RESOURCE_ITEM = re.compile(r"^(.*?)\s*\(\s*(\d+(?:\.\d+)?)\s*\)\s*$")
+STEP_NUMBER = re.compile(r"^\d+")
+TIME_EPSILON = 1e-6
+
+VALIDATION_CHECKS = OrderedDict([
+    ("completion", "Completed {bodies} assemblies of 1/4 body"),
+    ("automatic_serial", "Automatic operations are executed sequentially"),
+    ("overlap", "No manual/auto overlap"),
+    ("manual_parallel", "Only identical manual operations in parallel, at most {max_parallel_manual} at a time"),
+    ("shared_steps", "Shared steps correctly positioned"),
+    ("resources", "Resource limits maintained"),
+    ("predecessors", "Predecessor requirements met"),
+    ("operations", "Operations and durations match the knowledge graph")
+])
+# Checks that hold for any scheme; the others encode the Plan constraints of PLAN_RULES
+GENERIC_CHECKS = ["overlap", "resources", "predecessors", "operations"]
+
+
+def split_cells(line):
+    return [cell.strip() for cell in line.strip().strip("|").split("|")]
+
+
+def clean_text(text):
+    return text.replace("**", "").replace("`", "").strip()
+
+
+def parse_resources(text):
+    resources = OrderedDict()
+    for item in clean_text(text).split(","):
+        match = RESOURCE_ITEM.match(item.strip())
+        name, number = (match.group(1), float(match.group(2))) if match else (item.strip(), 1.0)
+        if name and name != "-":
+            resources[name] = number
+    return resources
+
+
+def parse_rows(lines, columns):
+    rows = []
+    for index, cells in lines:
+        if all(set(cell) <= set("-: ") for cell in cells):
+            continue
+        fields = dict(zip(columns, cells))
+        start, end = to_number(fields.get("start time")), to_number(fields.get("end time"))
+        operation = clean_text(fields.get("operation", ""))
+        if not operation or start is None or end is None:
+            continue
+        rows.append({
+            "line": index,
+            "order": clean_text(fields.get("order", "")),
+            "operation": operation,
+            "type": clean_text(fields.get("type", "")),
+            "resources": parse_resources(fields.get("required resources", "")),
+            "duration": to_number(fields.get("duration")),
+            "start": start,
+            "end": end,
+            "group": clean_text(fields.get("parallel group", "")) or "-"
+        })
+    return rows
+
+
+def parse_schedule(text, headerless=False):
+    blocks, block = [], []
+    for index, line in enumerate(str(text).splitlines()):
+        if line.strip().startswith("|"):
+            block.append((index, split_cells(line)))
+        elif block:
+            blocks.append(block)
+            block = []
+    if block:
+        blocks.append(block)
+
+    rows = []
+    for block in blocks:
+        header = [clean_text(cell).lower() for cell in block[0][1]]
+        if "order" in header and "operation" in header:
+            # Data tables of other shapes are ignored and a later scheme table supersedes an earlier one
+            rows = parse_rows(block[1:], header)
+        elif headerless:
+            rows += parse_rows(block, SCHEDULE_COLUMNS)
+    return rows
+
+
+class ScheduleValidator:
+
+    def __init__(self, problem, rules=None, checks=None):
+        self.scheduler = AssemblyScheduler(problem, rules)
+        self.checks = list(checks or VALIDATION_CHECKS)
+        self.rules = self.scheduler.rules
+        self.operations = self.scheduler.operations
+        self.resources = self.scheduler.resources
+
+    def validate(self, rows):
+        self.violations = []
+        self.names = [self.scheduler.resolve(row["operation"]) for row in rows]
+        # Rows in time order; ties keep the table order
+        self.order = sorted(range(len(rows)), key=lambda i: (rows[i]["start"], i))
+        self.check_operations(rows)
+        if "completion" in self.checks:
+            self.check_completion(rows)
+        if "shared_steps" in self.checks:
+            self.check_shared_steps(rows)
+        self.check_predecessors(rows)
+        self.check_concurrency(rows)
+        return self.violations
+
+    def report(self, check, indices, message):
+        if check not in self.checks:
+            return
+        self.violations.append({"check": check, "rows": sorted(set(indices)), "message": message})
+
+    def label(self, rows, index):
+        return f"Row {rows[index]['order'] or index + 1} ({rows[index]['operation']})"
+
+    def row_type(self, rows, index):
+        name = self.names[index]
+        known = self.operations[name]["type"] if name else None
+        return known or normalize_type(rows[index]["type"])
+
+    def row_resources(self, rows, index):
+        name = self.names[index]
+        required = self.operations[name]["resources"] if name else None
+        return required or rows[index]["resources"]
+
+    def check_operations(self, rows):
+        for index, name in enumerate(self.names):
+            if name is None:
+                self.report("operations", [index], f"{self.label(rows, index)} is not an operation in the knowledge graph")
+                continue
+            duration = self.operations[name]["duration"]
+            scheduled = rows[index]["end"] - rows[index]["start"]
+            if duration is not None and abs(scheduled - duration) > TIME_EPSILON:
+                self.report("operations", [index], f"{self.label(rows, index)} is scheduled for "
+                            f"{format_number(scheduled)} min but takes {format_number(duration)} min")
+
+    def check_completion(self, rows):
+        completions = {self.scheduler.resolve(self.rules["auto_completion"]),
+                       self.scheduler.resolve(self.rules["manual_completion"])} - {None}
+        indices = [i for i, name in enumerate(self.names) if name in completions]
+        if len(indices) != int(self.rules["bodies"]):
+            self.report("completion", indices, f"The scheme completes {len(indices)} 1/4 bodies "
+                        f"instead of {self.rules['bodies']}")
+
+    def check_shared_steps(self, rows):
+        occurrences = OrderedDict()
+        for position, index in enumerate(self.order):
+            occurrences.setdefault(self.names[index], []).append(position)
+
+        def positions(code):
+            return occurrences.get(self.scheduler.resolve(code), [])
+
+        for expected, code in enumerate(self.rules["start_operations"]):
+            if positions(code)[:1] != [expected]:
+                self.report("shared_steps", [self.order[p] for p in positions(code)],
+                            f"{code} must be operation {expected + 1} of the scheme")
+        for offset, code in enumerate(reversed(self.rules["end_operations"])):
+            if positions(code)[-1:] != [len(self.order) - 1 - offset]:
+                self.report("shared_steps", [self.order[p] for p in positions(code)],
+                            f"{code} must be operation {len(self.order) - offset} of the scheme")
+
+        once = self.rules["start_operations"] + self.rules["end_operations"]
+        if positions(self.rules["auto_completion"]):
+            once = once + self.rules["auto_setup"] + self.rules["auto_teardown"]
+        for code in once:
+            if len(positions(code)) != 1:
+                self.report("shared_steps", [self.order[p] for p in positions(code)],
+                            f"{code} must be executed exactly once, found {len(positions(code))}")
+
+        completion_positions = positions(self.rules["auto_completion"]) + positions(self.rules["manual_completion"])
+        last_completion = max(completion_positions, default=-1)
+        for code in self.rules["auto_teardown"] + self.rules["finish_operations"]:
+            found = positions(code)
+            if code in self.rules["finish_operations"] and not found:
+                self.report("shared_steps", [], f"{code} is missing after the final 1/4 body")
+            elif found and found[-1] < last_completion:
+                self.report("shared_steps", [self.order[found[-1]]],
+                            f"{code} must follow the final 1/4 body completion")
+
+    def check_predecessors(self, rows):
+        ends = {}
+        for index, name in enumerate(self.names):
+            if name:
+                ends.setdefault(name, []).append(rows[index]["end"])
+        for values in ends.values():
+            values.sort()
+
+        # The k-th run of an operation needs k finished runs of each predecessor, or all of a shared one
+        seen = Counter()
+        for index in self.order:
+            name = self.names[index]
+            if name is None:
+                continue
+            seen[name] += 1
+            start = rows[index]["start"]
+            for predecessor in self.scheduler.predecessors(name):
+                if predecessor not in ends:
+                    continue
+                required = min(seen[name], len(ends[predecessor]))
+                if bisect_right(ends[predecessor], start + TIME_EPSILON) < required:
+                    late = [i for i, n in enumerate(self.names) if n == predecessor and rows[i]["end"] > start]
+                    self.report("predecessors", [index] + late,
+                                f"{self.label(rows, index)} starts at {format_number(start)} before "
+                                f"{predecessor} has finished")
+
+    def check_concurrency(self, rows):
+        events = []
+        for index in range(len(rows)):
+            events.append((rows[index]["start"], 1, index))
+            events.append((rows[index]["end"], 0, index))
+
+        # Ends sort before starts at the same time, so back-to-back rows do not overlap
+        active = []
+        usage = Counter()
+        for _, kind, index in sorted(events):
+            resources = self.row_resources(rows, index)
+            if kind == 0:
+                if index in active:
+                    active.remove(index)
+                    usage.subtract(resources)
+                continue
+
+            for other in active:
+                self.check_pair(rows, index, other)
+            active.append(index)
+            usage.update(resources)
+
+            manual = [i for i in active if self.row_type(rows, i) != "Automatic"]
+            if len(manual) > int(self.rules["max_parallel_manual"]):
+                self.report("manual_parallel", manual, f"{len(manual)} manual operations run at the same time from "
+                            f"{format_number(rows[index]['start'])}")
+            for resource in resources:
+                quantity = self.resources.get(resource, {}).get("quantity")
+                if quantity is not None and usage[resource] > quantity + TIME_EPSILON:
+                    self.report("resources", [i for i in active if resource in self.row_resources(rows, i)],
+                                f"{resource} is needed {format_number(usage[resource])} times from "
+                                f"{format_number(rows[index]['start'])} but only {format_number(quantity)} are available")
+
+    def check_pair(self, rows, index, other):
+        types = {self.row_type(rows, index), self.row_type(rows, other)}
+        if types == {"Automatic"}:
+            check, reason = "automatic_serial", "two automatic operations"
+        elif "Automatic" in types:
+            check, reason = "overlap", "an automatic and a manual operation"
+        elif self.names[index] is None or self.names[index] != self.names[other]:
+            check, reason = "manual_parallel", "different manual operations"
+        else:
+            return
+        self.report(check, [index, other], f"{self.label(rows, index)} and {self.label(rows, other)} "
+                    f"overlap: {reason} cannot run in parallel")
+
+
+def validate_schedule(rows, problem, rules=None, checks=None):
+    return ScheduleValidator(problem, rules, checks).validate(rows)
+
+
+def render_report(violations, rules=None, source="knowledge graph", checks=None):
+    rules = dict(PLAN_RULES, **(rules or {}))
+    failed = {violation["check"] for violation in violations}
+    lines = [f"**Validation Report** (checked against the {source}):"]
+    for check, label in VALIDATION_CHECKS.items():
+        if checks is not None and check not in checks:
+            continue
+        lines.append(f"▪ [{'✗' if check in failed else '✓'}] {label.format(**rules)}")
+    if violations:
+        lines.append("")
+        lines.append("Violations:")
+        for message in OrderedDict.fromkeys(violation["message"] for violation in violations):
+            lines.append(f"- {message}")
+    return "\n".join(lines)
+
+
+def step_of(row):
+    match = STEP_NUMBER.match(row["order"])
+    return match.group() if match else row["order"]
+
+
+def failing_segment(rows, violations):
+    indices = [i for violation in violations for i in violation["rows"]]
+    if not indices:
+        return None
+    first, last = min(indices), max(indices)
+    # Parallel rows share a step number and are regenerated together
+    while first > 0 and step_of(rows[first - 1]) == step_of(rows[first]):
+        first -= 1
+    while last < len(rows) - 1 and step_of(rows[last + 1]) == step_of(rows[last]):
+        last += 1
+    return first, last
+
+
+def splice_segment(rows, first, last, new_rows):
+    old_end = max(row["end"] for row in rows[first:last + 1])
+    new_end = max(row["end"] for row in new_rows)
+    shift = new_end - old_end
+    following = [dict(row, start=row["start"] + shift, end=row["end"] + shift) for row in rows[last + 1:]]
+    return renumber(rows[:first] + [dict(row) for row in new_rows] + following)
+
+
+def renumber(rows):
+    rows = sorted(rows, key=lambda row: row["start"])
+    starts = Counter(row["start"] for row in rows)
+    lane = Counter()
+    step = 0
+    for index, row in enumerate(rows):
+        if index == 0 or row["start"] != rows[index - 1]["start"]:
+            step += 1
+        if starts[row["start"]] > 1:
+            row["group"] = chr(ord("a") + lane[row["start"]])
+            row["order"] = f"{step}{row['group']}"
+            lane[row["start"]] += 1
+        else:
+            row["group"] = "-"
+            row["order"] = str(step)
+    return rows
+
+
+def render_rows(rows, header=True):
+    lines = []
+    if header:
+        lines.append("| Order | Operation | Type | Required Resources | Duration | Start Time | End Time | Parallel Group |")
+        lines.append("|-------|-----------|------|--------------------|----------|------------|----------|----------------|")
+    for row in rows:
+        required = ", ".join(f"{r} ({format_number(n)})" for r, n in row["resources"].items())
+        lines.append(f"| {row['order']} | {row['operation']} | {row['type']} | {required} "
+                     f"| {format_number(row['end'] - row['start'])} | {format_number(row['start'])} "
+                     f"| {format_number(row['end'])} | {row['group']} |")
+    return "\n".join(lines)
+
+
+def render_totals(rows, problem):
+    scheduler = AssemblyScheduler(problem)
+    cost = 0.0
+    for row in rows:
+        name = scheduler.resolve(row["operation"])
+        if name:
+            cost += (row["end"] - row["start"]) / 60 * scheduler.hourly_cost(name)
+    makespan = max(row["end"] for row in rows) - min(row["start"] for row in rows)
+    return f"Total time: {format_number(makespan)} min\nTotal cost: {format_number(cost)} €"
+
+
+def describe_operations(problem, names):
+    scheduler = AssemblyScheduler(problem)
+    lines = ["| Operation | Type | Duration (min) | Required Resources | Immediate Predecessors |",
+             "|-----------|------|----------------|--------------------|------------------------|"]
+    for name in OrderedDict.fromkeys(n for n in map(scheduler.resolve, names) if n):
+        record = problem["operations"][name]
+        resources = ", ".join(f"{r} ({format_number(n or 1)})" for r, n in record["resources"].items())
+        duration = format_number(record["duration"]) if record["duration"] is not None else ""
+        lines.append(f"| {name} | {record['type'] or ''} | {duration} | {resources} "
+                     f"| {', '.join(scheduler.predecessors(name))} |")
+    return "\n".join(lines)